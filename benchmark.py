@@ -0,0 +1,279 @@
+# benchmark.py
+"""Verificação diferencial: motor de referência x motores otimizados.
+
+A referência é `referencia.fluxo_referencia`, cópia congelada do algoritmo original do
+`app_body` (lista completa, ordenação e rótulo k/N em segunda passada), sem código em comum
+com `fluxo.py`. Cada motor — inclusive `simular_fluxo` detalhado — roda sobre as mesmas
+propostas aleatórias e é comparado linha a linha (ou pelo resumo, quando o motor não gera
+linhas). O relatório traz o tempo, o speedup e, se houver, a primeira divergência.
+
+A conferência "exportacao" (só com `--motor exportacao`) grava xlsx (`exportar_fluxo`) e CSV
+dentro de .zip (`exportar_lote`), relê os arquivos e compara célula a célula — inclusive a
+linha TOTAIS — com a planilha que o app original montaria. Roda numa amostra das propostas e
+não tem speedup: o tempo é quase todo do openpyxl gravando e relendo os arquivos.
+
+A referência congelada só conhece taxas escalares. Com `--vigencias` as propostas usam
+também `SerieTaxa` e a comparação passa a ser contra `simular_fluxo` detalhado: é só um teste
+de consistência entre os motores, não contra o original.
+
+Uso:
+    python benchmark.py                 # 2000 propostas, semente 0
+    python benchmark.py -n 5000 -s 42 --motor streaming
+    python benchmark.py --motor exportacao
+    python benchmark.py --vigencias
+"""
+import argparse
+import calendar
+import csv
+import io
+import random
+import sys
+import time as _time
+import zipfile
+from datetime import datetime as dt, timedelta
+
+from openpyxl import load_workbook
+
+import fluxo
+import referencia
+
+PERIODOS = ['pré-entrega da chave', 'pós-entrega da chave', 'ambos']
+
+
+def _taxa(rng, escalar, vigencias):
+    """Taxa escalar ou, com `vigencias`, às vezes uma `SerieTaxa` com vigências mensais."""
+    if not vigencias or rng.random() < 0.8:
+        return escalar
+    ano = rng.randint(2023, 2030)
+    return fluxo.SerieTaxa({(ano + k // 12, k % 12 + 1): rng.uniform(0, escalar * 2 or 0.01)
+                            for k in range(0, rng.randint(1, 120), rng.randint(1, 12))})
+
+
+def proposta_aleatoria(rng, vigencias=False):
+    """Gera (I, E) no formato de `st.session_state.inputs` / `st.session_state.extras`."""
+    data_base = dt(rng.randint(2023, 2027), rng.randint(1, 12), rng.randint(1, 28))
+    data_inicio_pre = data_base + timedelta(days=rng.randint(-40, 90))
+    data_entrega = data_inicio_pre + timedelta(days=rng.randint(-30, 1500))
+    if rng.random() < 0.2:
+        # entrega no fim do mês (dias 29-31)
+        data_entrega = fluxo.adjust_day(data_entrega, 31) - timedelta(days=rng.randint(0, 2))
+    dia_pagamento = rng.choice([1, 5, 10, 15, 28, 29, 30, 31, 29, 30, 31])
+    valor_imovel = rng.uniform(80_000, 600_000)
+
+    I = {
+        "cliente": "Benchmark",
+        "dia_pagamento": dia_pagamento,
+        "valor_imovel": valor_imovel,
+        "empreendimento": "Benchmark",
+        "taxas_sel": {},
+        "TAXA_EMISSAO_CCB": rng.choice([0.0, 150.0, 500.0]),
+        "TAXA_EMISSAO_CONTRATO_ALIENACAO_FIDUCIARIA": rng.choice([0.0, 300.0]),
+        "TAXA_REGISTRO_IMOVEL": rng.choice([0.0, 200.0, 1200.0]),
+        "TAXA_ESCRITURA_IMOVEL": rng.choice([0.0, 200.0, 900.0]),
+        "TAXA_SEGURO_PRESTAMISTA_PCT": rng.choice([0.0, 0.0083, 0.012]),
+        "TAXA_INCC": _taxa(rng, rng.choice([0.0, 0.006]), vigencias),
+        "TAXA_IPCA": _taxa(rng, rng.choice([0.0, 0.004]), vigencias),
+        "taxa_pre": _taxa(rng, rng.choice([0.0, 0.02]), vigencias),
+        "taxa_pos": _taxa(rng, rng.choice([0.00094, 0.01, 0.018]), vigencias),
+        "taxas_extras": [{'pct': _taxa(rng, rng.choice([0.0, 0.001, 0.003]), vigencias), 'periodo': rng.choice(PERIODOS)}
+                         for _ in range(rng.randint(0, 3))],
+        "data_base": data_base,
+        "data_inicio_pre": data_inicio_pre,
+        "data_entrega": data_entrega,
+        "capacidade_pre": rng.uniform(0, 4000),
+        "capacidade_pos_antes": 0.0,
+        "val_parcela_banco": 0.0,
+        "capacidade_pos": 0.0,
+        "fgts": rng.choice([0.0, rng.uniform(0, 40_000)]),
+        "fin_banco": rng.choice([0.0, rng.uniform(0, valor_imovel / 2)]),
+    }
+    I["capacidade_pos"] = I["capacidade_pos_antes"] = rng.uniform(300, 8000)
+
+    def data_extra():
+        return data_entrega + timedelta(days=rng.randint(-900, 5000))
+
+    non_rec = []
+    for i in range(rng.randint(0, 8)):
+        d = data_extra()
+        assoc = rng.random() < 0.5
+        if assoc:
+            d = fluxo.adjust_day(d, dia_pagamento)
+        non_rec.append({'data': d, 'tipo': f"Pagamento adicional {i + 1}", 'valor': rng.uniform(0, 30_000), 'assoc': assoc})
+    semi_series = [{'d0': data_extra(), 'v': rng.uniform(0, 8000), 'assoc': rng.random() < 0.5,
+                    'tipo': 'Pagamento Semestral'} for _ in range(rng.randint(0, 4))]
+    annual_series = [{'d0': data_extra(), 'v': rng.uniform(0, 15_000), 'assoc': rng.random() < 0.5,
+                      'tipo': 'Pagamento Anual'} for _ in range(rng.randint(0, 4))]
+    return I, {"non_rec": non_rec, "semi_series": semi_series, "annual_series": annual_series}
+
+
+def _referencia_atual(I, E):
+    """`simular_fluxo` detalhado, no formato de `referencia.fluxo_referencia` (só para --vigencias)."""
+    resultado = fluxo.simular_fluxo(I, E)
+    eventos = resultado["eventos"]
+    eventos_sorted = fluxo.rotular_parcelas(eventos)
+    fixas = (fluxo.taxa_em(I["TAXA_EMISSAO_CCB"], I["data_entrega"])
+             + fluxo.taxa_em(I["TAXA_EMISSAO_CONTRATO_ALIENACAO_FIDUCIARIA"], I["data_entrega"])
+             + fluxo.taxa_em(I["TAXA_REGISTRO_IMOVEL"], I["data_entrega"])
+             + fluxo.taxa_em(I["TAXA_ESCRITURA_IMOVEL"], I["data_entrega"]))
+    return {**resultado, "eventos_sorted": eventos_sorted,
+            "soma_total": sum(ev['valor'] for ev in eventos) + (fixas + resultado["fee"]),
+            "soma_juros": sum(ev['juros'] for ev in eventos)}
+
+
+def _diverge_campos(ref, saida, campos=("saldo", "parcelas", "fee")):
+    for chave in campos:
+        if ref[chave] != saida[chave]:
+            return f"{chave}: referência={ref[chave]!r} motor={saida[chave]!r}"
+    return None
+
+
+def _diverge_lista(linhas, saida):
+    for i, (a, b) in enumerate(zip(linhas, saida)):
+        if a != b:
+            return f"linha {i}:\n    referência: {a}\n    motor:      {b}"
+    if len(linhas) != len(saida):
+        return f"quantidade de linhas: referência={len(linhas)} motor={len(saida)}"
+    return None
+
+
+def _diverge_detalhado(ref, saida):
+    resultado, linhas = saida
+    return _diverge_campos(ref, resultado) or _diverge_lista(ref["eventos_sorted"], linhas)
+
+
+def _diverge_resumo(ref, saida):
+    motivo = _diverge_campos(ref, saida)
+    if motivo:
+        return motivo
+    entrega = next(ev['saldo'] for ev in ref["eventos"] if ev['tipo'] == 'Data da entrega das chaves')
+    if entrega != saida["saldo_entrega"]:
+        return f"saldo_entrega: referência={entrega!r} motor={saida['saldo_entrega']!r}"
+    return None
+
+
+def _diverge_linhas(ref, saida):
+    return _diverge_lista(ref["eventos_sorted"], saida)
+
+
+def _detalhado(I, E):
+    resultado = fluxo.simular_fluxo(I, E)
+    return resultado, fluxo.rotular_parcelas(resultado["eventos"])
+
+
+def _exportacao(I, E):
+    buf = io.BytesIO()
+    fluxo.exportar_fluxo(I, E, buf, "xlsx")
+    buf.seek(0)
+    wb = load_workbook(buf, read_only=True)
+    xlsx = [list(row) for row in wb.worksheets[0].iter_rows(values_only=True)]
+    wb.close()
+
+    zbuf = io.BytesIO()
+    fluxo.exportar_lote([("contrato", I, E)], zbuf, "csv")
+    with zipfile.ZipFile(zbuf) as zf:
+        texto = zf.read("contrato.csv").decode("utf-8-sig")
+    return {"xlsx": xlsx, "csv": list(csv.reader(io.StringIO(texto, newline="")))}
+
+
+def _planilha_referencia(ref):
+    """Linhas da aba que o app original gravaria (cabeçalho, saldo inicial, eventos, branco, TOTAIS)."""
+    I = ref["I"]
+    n_extras = len(I["taxas_extras"])
+    headers = ["Data","Parcela","Tipo","Dias no Mês","Dias Corridos","Taxa Efetiva","Valor Pago (R$)",
+               "Juros (R$)"]
+    headers += [f"Taxa {i+1} (R$)" for i in range(n_extras)]
+    headers += ["Total de adições e subtrações (R$)","Saldo Devedor (R$)"]
+    linhas = [headers, ["-"] * (len(headers) - 1) + [I["valor_imovel"]]]
+    for ev in ref["eventos_sorted"]:
+        linhas.append([ev['data'], ev['parcela'], ev['tipo'], calendar.monthrange(ev['data'].year, ev['data'].month)[1],
+                       ev['dias_corridos'], ev['taxa_efetiva'], ev['valor'], ev['juros']]
+                      + ev['taxas_extra'] + [ev['Total de mudança (R$)'], ev['saldo']])
+    linhas.append([''] * len(headers))
+    linhas.append(['TOTAIS', '', '', '', '', '', ref["soma_total"], ref["soma_juros"]])
+    return linhas, len(headers)
+
+
+def _diverge_exportacao(ref, saida):
+    esperado, largura = _planilha_referencia(ref)
+    # células vazias voltam do xlsx como None; linhas curtas são completadas com ''
+    norm = lambda row: [('' if v is None else v) for v in row] + [''] * (largura - len(row))
+    # o openpyxl grava floats com "%.16g" (também na planilha do app original); o CSV usa repr
+    xlsx = lambda row: [float("%.16g" % v) if isinstance(v, float) else v for v in row]
+    texto = lambda row: [v.strftime("%d/%m/%Y") if isinstance(v, dt) else str(v) for v in row]
+    for formato, conv in (("xlsx", xlsx), ("csv", texto)):
+        alvo = [conv(norm(r)) for r in esperado]
+        motivo = _diverge_lista(alvo, [norm(r) for r in saida[formato]])
+        if motivo:
+            return f"{formato} {motivo}"
+    return None
+
+
+# nome -> (execução, comparação com a saída da referência)
+MOTORES = {
+    "detalhado": (_detalhado, _diverge_detalhado),
+    "resumo": (lambda I, E: fluxo.simular_fluxo(I, E, detalhado=False), _diverge_resumo),
+    "streaming": (lambda I, E: list(fluxo.gerar_linhas(I, E)), _diverge_linhas),
+}
+
+# nome -> (execução, comparação, tamanho da amostra); fora do padrão e sem speedup
+CONFERENCIAS = {
+    "exportacao": (_exportacao, _diverge_exportacao, 200),
+}
+
+
+def executar(n, semente, motores, vigencias=False):
+    rng = random.Random(semente)
+    propostas = [proposta_aleatoria(rng, vigencias) for _ in range(n)]
+    rodar_ref = _referencia_atual if vigencias else referencia.fluxo_referencia
+    nome_ref = "simular_fluxo" if vigencias else "referência"
+
+    t0 = _time.perf_counter()
+    refs = [{**rodar_ref(I, E), "I": I} for I, E in propostas]
+    t_ref = _time.perf_counter() - t0
+    linhas = sum(len(r["eventos_sorted"]) for r in refs)
+    print(f"{n} propostas (semente {semente}), {linhas} linhas na referência")
+    if vigencias:
+        print("  (--vigencias: comparação contra simular_fluxo detalhado, não contra a cópia congelada)")
+    print(f"  {nome_ref:<14} {t_ref:8.3f}s")
+
+    ok = True
+    for nome in motores:
+        if nome in CONFERENCIAS:
+            rodar, diverge, amostra = CONFERENCIAS[nome]
+            amostra = min(amostra, n)
+        else:
+            (rodar, diverge), amostra = MOTORES[nome], n
+        t0 = _time.perf_counter()
+        saidas = [rodar(I, E) for I, E in propostas[:amostra]]
+        t_motor = _time.perf_counter() - t0
+        if nome in CONFERENCIAS:
+            print(f"  {nome:<14} {t_motor:8.3f}s  ({amostra} propostas, sem speedup)")
+        else:
+            speedup = t_ref / t_motor if t_motor else float("inf")
+            print(f"  {nome:<14} {t_motor:8.3f}s  speedup {speedup:6.2f}x")
+        for k, (ref, saida) in enumerate(zip(refs, saidas)):
+            motivo = diverge(ref, saida)
+            if motivo:
+                ok = False
+                print(f"    DIVERGE na proposta {k} ({nome}) -> {motivo}")
+                break
+        else:
+            print("    idêntico à referência")
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verificação diferencial dos motores de simulação.")
+    parser.add_argument("-n", type=int, default=2000, help="quantidade de propostas aleatórias")
+    parser.add_argument("-s", "--semente", type=int, default=0, help="semente do gerador aleatório")
+    parser.add_argument("--motor", action="append", choices=sorted(MOTORES) + sorted(CONFERENCIAS),
+                        help="motor a comparar (repita para vários; padrão: todos menos as conferências, "
+                             "como exportacao)")
+    parser.add_argument("--vigencias", action="store_true",
+                        help="usa taxas com vigência (SerieTaxa); compara contra simular_fluxo detalhado")
+    args = parser.parse_args(argv)
+    return 0 if executar(args.n, args.semente, args.motor or sorted(MOTORES), args.vigencias) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -62,11 +62,16 @@ def add_corner_image(image_path: Path, width_px: int = 80, corner: str = "top-le
 
 
 from pathlib import Path
-from io import BytesIO
+from io import BytesIO, TextIOWrapper
+import csv
+import zipfile
 import calendar
+import math
+from contextlib import nullcontext
 from datetime import datetime as dt, time
 from dateutil.relativedelta import relativedelta
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, PatternFill
 from openpyxl.utils import get_column_letter
 from openpyxl.styles import Font, PatternFill, Border, Side
@@ -82,16 +87,104 @@ PERCENT_FORMAT = '0.00%'
 GREEN_COLOR = "FF00B050"  # verde
 RED_COLOR   = "FFFF0000"  # vermelho
 
-def load_taxas(filepath: str) -> dict:
-    taxas = {}
-    path = Path(filepath)
-    if not path.exists():
-        return taxas
+class SerieTaxa:
+    """Taxa mensal variável no tempo (vigências em taxas.txt ou série de índice em arquivo).
+
+    Os pontos são compilados num vetor denso, um valor por mês, preenchido para frente; a consulta
+    é por índice do mês (custo constante). Antes do primeiro mês vale o primeiro valor e depois do
+    último, o último.
+    """
+    def __init__(self, pontos):
+        if not pontos:
+            raise ValueError("SerieTaxa precisa de ao menos um ponto (mês, valor)")
+        meses = sorted(pontos)
+        self.inicio = meses[0][0] * 12 + meses[0][1] - 1
+        fim = meses[-1][0] * 12 + meses[-1][1] - 1
+        self.valores = []
+        atual = pontos[meses[0]]
+        for idx in range(self.inicio, fim + 1):
+            atual = pontos.get((idx // 12, idx % 12 + 1), atual)
+            self.valores.append(atual)
+    def valor_em(self, data):
+        i = data.year * 12 + data.month - 1 - self.inicio
+        if i < 0:
+            i = 0
+        elif i >= len(self.valores):
+            i = len(self.valores) - 1
+        return self.valores[i]
+
+def taxa_em(taxa, data):
+    """Valor da taxa na data: escalares passam direto, séries são consultadas pelo mês."""
+    if isinstance(taxa, SerieTaxa):
+        return taxa.valor_em(data)
+    return taxa
+
+def _mes_ano(texto: str):
+    ano, mes = texto.strip().split('-')[:2]
+    ano, mes = int(ano), int(mes)
+    if not 1 <= mes <= 12:
+        raise ValueError(texto)
+    return ano, mes
+
+def _versao_arquivo(path: Path):
+    info = path.stat()
+    return info.st_mtime_ns, info.st_size
+
+def _versao_dependencia(path: Path):
+    """Versão de uma série referenciada; None se o arquivo não existe (para o cache notar quando surgir)."""
     try:
-        content = path.read_text(encoding='utf-8').strip()
-    except Exception as e:
-        st.error(f"Erro ao ler {filepath}: {e}")
-        return taxas
+        return _versao_arquivo(path)
+    except FileNotFoundError:
+        return None
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _ler_serie_arquivo(caminho: str, versao) -> dict:
+    """Lê uma série mensal (linhas `AAAA-MM;valor`, vírgula decimal aceita). Cache por versão do arquivo.
+
+    Aceita UTF-8 e, como alternativa, cp1252 (padrão de CSV exportado pelo Excel em pt-BR).
+    """
+    pontos = {}
+    bruto = Path(caminho).read_bytes()
+    try:
+        texto = bruto.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        texto = bruto.decode('cp1252')
+    for linha in texto.splitlines():
+        linha = linha.strip()
+        if not linha or linha.startswith('#'):
+            continue
+        sep = ';' if ';' in linha else ','
+        try:
+            mes, valor = linha.split(sep, 1)
+            pontos[_mes_ano(mes)] = float(valor.strip().replace(',', '.'))
+        except ValueError:
+            continue  # cabeçalho ou linha inválida
+    return pontos
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _series_referenciadas(caminho: str, versao) -> tuple:
+    """Arquivos `serie:` citados no taxas.txt (caminhos relativos à pasta dele)."""
+    path = Path(caminho)
+    series = []
+    for linha in path.read_text(encoding='utf-8').splitlines():
+        if '=' in linha:
+            valor = linha.split('=', 1)[1].strip()
+            if valor.startswith('serie:'):
+                series.append(str(path.parent / valor[len('serie:'):].strip()))
+    return tuple(dict.fromkeys(series))
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _compilar_taxas(caminho: str, versao, versoes_series: tuple):
+    """Interpreta o taxas.txt e compila as `SerieTaxa`. Cache pela versão do arquivo e das séries.
+
+    Devolve `(taxas, avisos)`; os avisos (`"erro"`/`"aviso"`, mensagem) não são emitidos aqui
+    para que `load_taxas` os repita a cada execução, também quando o resultado vem do cache.
+    """
+    path = Path(caminho)
+    versoes_series = dict(versoes_series)
+    content = path.read_text(encoding='utf-8').strip()
+    taxas = {}
+    avisos = []
     blocos = [b.strip() for b in content.split("\n\n") if b.strip()]
     for bloco in blocos:
         linhas = bloco.splitlines()
@@ -99,15 +192,75 @@ def load_taxas(filepath: str) -> dict:
             continue
         nome = linhas[0].strip()
         taxas[nome] = {}
+        vigencias = {}
         for linha in linhas[1:]:
             if '=' in linha:
                 chave, valor = linha.split('=', 1)
                 chave = chave.strip()
                 valor = valor.strip()
+                if '@' in chave:
+                    chave, mes = chave.split('@', 1)
+                    try:
+                        vigencia = _mes_ano(mes), float(valor)
+                    except ValueError:
+                        avisos.append(("aviso", f"Vigência inválida em {caminho} ({nome}), linha ignorada: {linha.strip()}"))
+                        continue
+                    vigencias.setdefault(chave.strip(), {})[vigencia[0]] = vigencia[1]
+                    continue
+                if valor.startswith('serie:'):
+                    arq = str(path.parent / valor[len('serie:'):].strip())
+                    try:
+                        pontos = _ler_serie_arquivo(arq, versoes_series.get(arq))
+                    except (OSError, ValueError) as e:
+                        avisos.append(("erro", f"Erro ao ler a série {arq}: {e}. {chave} ignorada em {nome}."))
+                        continue
+                    if not pontos:
+                        avisos.append(("erro", f"A série {arq} não tem linhas `AAAA-MM;valor` válidas. "
+                                               f"{chave} ignorada em {nome}."))
+                        continue
+                    vigencias.setdefault(chave, {}).update(
+                        {m: v for m, v in pontos.items() if m not in vigencias.get(chave, {})})
+                    continue
                 try:
                     taxas[nome][chave] = float(valor)
                 except ValueError:
                     taxas[nome][chave] = valor
+        # vigências: o valor escalar (se houver) vale até o mês anterior à primeira vigência
+        for chave, pontos in vigencias.items():
+            base = taxas[nome].get(chave)
+            if isinstance(base, float):
+                ano, mes = min(pontos)
+                anterior = (ano, mes - 1) if mes > 1 else (ano - 1, 12)
+                pontos = {anterior: base, **pontos}
+            taxas[nome][chave] = SerieTaxa(pontos)
+    return taxas, avisos
+
+def load_taxas(filepath: str) -> dict:
+    """Lê taxas.txt por empreendimento.
+
+    Além de `CHAVE = valor`, aceita vigências (`CHAVE @ AAAA-MM = valor`, valendo a partir do mês)
+    e séries de índice mensais (`CHAVE = serie:arquivo.csv`, caminho relativo ao taxas.txt).
+    Chaves com vigência ou série viram `SerieTaxa`. A compilação fica em `st.cache_data`, pela
+    versão (mtime/tamanho) do taxas.txt e das séries referenciadas, e sobrevive aos reruns do app.
+    Linhas e séries com problema são avisadas em toda chamada.
+    """
+    taxas = {}
+    path = Path(filepath)
+    if not path.exists():
+        return taxas
+    try:
+        versao = _versao_arquivo(path)
+        series = _series_referenciadas(str(path), versao)
+        versoes_series = tuple((arq, _versao_dependencia(Path(arq))) for arq in series)
+        taxas, avisos = _compilar_taxas(str(path), versao, versoes_series)
+    except Exception as e:
+        st.error(f"Erro ao ler {filepath}: {e}")
+        return {}
+    for nivel, mensagem in avisos:
+        if nivel == "erro":
+            st.error(mensagem)
+        else:
+            st.warning(mensagem)
     return taxas
 
 def adjust_day(date, preferred_day):
@@ -130,11 +283,798 @@ class PaymentTracker:
             self.last_date = current_date
             return 0.0, 0, 0.0
         dias_corridos = (current_date - self.last_date).days
-        taxa_efetiva = self.taxa * (dias_corridos / 30)
+        taxa_efetiva = taxa_em(self.taxa, current_date) * (dias_corridos / 30)
         juros = saldo * taxa_efetiva
         self.last_date = current_date
         return juros, dias_corridos, taxa_efetiva
 
+def taxas_do_empreendimento(taxas_sel: dict) -> dict:
+    """Extrai de um bloco do taxas.txt as taxas usadas pelo motor (faltantes valem 0)."""
+    # Extras percentuais
+    taxas_extras = []
+    for chave, val in taxas_sel.items():
+        if chave.endswith('_PCT') and chave not in ['TAXA_SEGURO_PRESTAMISTA_PCT']:
+            periodo = 'pré-entrega da chave' if 'INCC' in chave else 'pós-entrega da chave'
+            taxas_extras.append({'pct': val, 'periodo': periodo})
+    return {
+        "TAXA_EMISSAO_CCB": taxas_sel.get('TAXA_EMISSAO_CCB', 0.0),
+        "TAXA_EMISSAO_CONTRATO_ALIENACAO_FIDUCIARIA": taxas_sel.get('TAXA_EMISSAO_CONTRATO_ALIENACAO_FIDUCIARIA', 0.0),
+        "TAXA_REGISTRO_IMOVEL": taxas_sel.get('TAXA_REGISTRO_IMOVEL', 0.0),
+        "TAXA_ESCRITURA_IMOVEL": taxas_sel.get('TAXA_ESCRITURA_IMOVEL', 0.0),
+        "TAXA_SEGURO_PRESTAMISTA_PCT": taxas_sel.get('TAXA_SEGURO_PRESTAMISTA_PCT', 0.0),
+        "TAXA_INCC": taxas_sel.get('TAXA_INCC', 0.0),
+        "TAXA_IPCA": taxas_sel.get('TAXA_IPCA', 0.0),
+        "taxa_pre": taxas_sel.get('taxa_pre', 0.0),
+        "taxa_pos": taxas_sel.get('taxa_pos', 0.0),
+        "taxas_extras": taxas_extras,
+    }
+
+# ==========================
+# Motor da simulação
+# ==========================
+def expandir_extras(E, dia_pagamento):
+    """Copia os pagamentos únicos e expande as séries semestrais/anuais na agenda bruta."""
+    # Copia listas de extras
+    non_rec = list(E["non_rec"])
+    semi_series = list(E["semi_series"])
+    annual_series = list(E["annual_series"])
+
+    # Agrega séries recorrentes (gera agenda bruta)
+    for series in semi_series:
+        for n in range(100):
+            d = series['d0'] + relativedelta(months=6 * n)
+            if series['assoc']:
+                d = adjust_day(d, dia_pagamento)
+            non_rec.append({'data': d, 'tipo': 'Pagamento Semestral', 'valor': series['v'], 'assoc': series['assoc']})
+    for series in annual_series:
+        for n in range(100):
+            d = series['d0'] + relativedelta(years=n)
+            if series['assoc']:
+                d = adjust_day(d, dia_pagamento)
+            non_rec.append({'data': d, 'tipo': 'Pagamento Anual', 'valor': series['v'], 'assoc': series['assoc']})
+    return non_rec
+
+
+def preparar_agenda(I, E):
+    """Parte do fluxo que não depende das taxas: extras expandidos e separados em pré/pós-entrega
+    e a grade de vencimentos pós-entrega. Pode ser reaproveitada entre empreendimentos.
+
+    `post_nr` para na 420ª parcela: as séries expandidas vão até 50/100 anos, e extras depois do
+    último vencimento nunca entram no fluxo (deixá-los impediria o avanço rápido da cauda).
+    """
+    dia_pagamento = I["dia_pagamento"]
+    data_entrega = I["data_entrega"]
+    non_rec = expandir_extras(E, dia_pagamento)
+    vencimentos = [_vencimento(data_entrega, k, dia_pagamento) for k in range(1, 421)]
+    return {
+        "non_rec": non_rec,
+        "pre_nr": sorted([e for e in non_rec if e['data'] < data_entrega], key=lambda x: x['data']),
+        "post_nr": sorted([e for e in non_rec if data_entrega <= e['data'] <= vencimentos[-1]],
+                          key=lambda x: x['data']),
+        "vencimentos": vencimentos,
+    }
+
+
+def _linha(data, tipo, valor, juros, dias_corr, taxa_eff, incc, ipca, extras, mudanca, saldo, parcela=''):
+    """Linha (evento) do fluxo no formato usado pela planilha."""
+    return {
+        'data': data, 'parcela': parcela, 'tipo': tipo, 'valor': valor,
+        'juros': juros, 'dias_corridos': dias_corr, 'taxa_efetiva': taxa_eff,
+        'incc': incc, 'ipca': ipca, 'taxas_extra': extras,
+        'Total de mudança (R$)': mudanca, 'saldo': saldo
+    }
+
+
+def _linha_data_base(I):
+    return _linha(I["data_base"], 'Data-Base (assinatura do contrato)', 0.0, 0.0, 0, 0.0, 0.0, 0.0,
+                  [0.0] * len(I["taxas_extras"]), 0.0, I["valor_imovel"])
+
+
+def _linhas_fluxo(I, agenda):
+    """Gerador das linhas do fluxo (sem a data-base), na ordem em que são calculadas.
+
+    É o motor detalhado: `simular_fluxo` guarda as linhas, `gerar_linhas` as repassa em
+    streaming. Ao terminar, devolve (no `StopIteration`) a tupla `(saldo, parcelas, fee)`.
+    """
+    dia_pagamento = I["dia_pagamento"]
+    taxas_extras = I["taxas_extras"]
+    data_entrega = I["data_entrega"]
+    zero_extras = [0.0] * len(taxas_extras)
+
+    def extra_nao_associado(ev, tracker, saldo, pre):
+        periodos = ['pré-entrega da chave', 'ambos'] if pre else ['pós-entrega da chave', 'ambos']
+        juros, dias_corr, taxa_eff = tracker.calculate(ev['data'], saldo)
+        indice = saldo * taxa_em(I["TAXA_INCC"] if pre else I["TAXA_IPCA"], ev['data'])
+        extras = [saldo * taxa_em(t['pct'], ev['data']) if t['periodo'] in periodos else 0.0 for t in taxas_extras]
+        abat = ev['valor'] - juros - (sum(extras) + indice)
+        saldo -= abat
+        return saldo, _linha(ev['data'], ev['tipo'], ev['valor'], juros, dias_corr, taxa_eff,
+                             indice if pre else 0.0, 0.0 if pre else indice, extras, -abat, saldo)
+
+    def parcela_mensal(d_evt, tracker, saldo, pre, valor_total, parcela):
+        periodos = ['pré-entrega da chave', 'ambos'] if pre else ['pós-entrega da chave', 'ambos']
+        juros, dias_corr, taxa_eff = tracker.calculate(d_evt, saldo)
+        indice = saldo * taxa_em(I["TAXA_INCC"] if pre else I["TAXA_IPCA"], d_evt)
+        extras = [saldo * taxa_em(t['pct'], d_evt) if t['periodo'] in periodos else 0.0 for t in taxas_extras]
+        abat = valor_total - juros - (sum(extras) + indice)
+        saldo -= abat
+        return saldo, _linha(d_evt, 'Pré-Entrega' if pre else 'Pós-Entrega', valor_total, juros, dias_corr,
+                             taxa_eff, indice if pre else 0.0, 0.0 if pre else indice, extras, -abat, saldo,
+                             parcela)
+
+    def associado(ev, d_evt, saldo):
+        saldo -= ev['valor']  # 100% para principal
+        return saldo, _linha(d_evt, ev['tipo'] + " (Associado)", ev['valor'], 0.0, 0, 0.0, 0.0, 0.0,
+                             [0.0] * len(taxas_extras), -ev['valor'], saldo)
+
+    saldo = I["valor_imovel"]
+
+    # ========== PRÉ-ENTREGA ==========
+    pre_nr = agenda["pre_nr"]
+    tracker = PaymentTracker(dia_pagamento, I["taxa_pre"])
+    tracker.last_date = I["data_base"]
+    i = 0
+    prev_date = cursor = I["data_inicio_pre"]
+    while True:
+        d_evt = adjust_day(cursor, dia_pagamento)
+        if d_evt >= data_entrega:
+            break
+        # (a) não-associados entre prev_date e d_evt
+        while i < len(pre_nr) and pre_nr[i]['data'] < d_evt:
+            ev = pre_nr[i]
+            i += 1
+            if not ev['assoc'] and ev['data'] > prev_date:
+                saldo, row = extra_nao_associado(ev, tracker, saldo, True)
+                yield row
+        # (b) parcela mensal — encargos calculados ANTES dos associados
+        saldo, row = parcela_mensal(d_evt, tracker, saldo, True, I["capacidade_pre"], '')
+        yield row
+        # (c) associados do dia — linhas separadas, sem encargos, DEPOIS da parcela
+        while i < len(pre_nr) and pre_nr[i]['data'] == d_evt:
+            ev = pre_nr[i]
+            i += 1
+            if ev['assoc']:
+                saldo, row = associado(ev, d_evt, saldo)
+                yield row
+        prev_date = d_evt
+        cursor += relativedelta(months=1)
+
+    # ========== ENTREGA ==========
+    ent = data_entrega
+    for desc, v in [('Abatimento FGTS', I["fgts"]), ('Abatimento Fin. Banco', I["fin_banco"])]:
+        saldo -= v
+        yield _linha(ent, desc, 0.0, 0.0, '', '', 0.0, 0.0, zero_extras, -v, saldo)  # abatimento => negativo
+    for nome, val in _taxas_entrega(I):
+        saldo += val
+        yield _linha(ent, 'Taxa ' + nome, 0.0, 0.0, '', '', 0.0, 0.0, zero_extras, val, saldo)  # adição => positivo
+    fee = saldo * taxa_em(I["TAXA_SEGURO_PRESTAMISTA_PCT"], ent)
+    saldo += fee
+    yield _linha(ent, 'Taxa Seguro Prestamista', 0.0, 0.0, '', '', 0.0, 0.0, zero_extras, fee, saldo)
+    yield _linha(ent, 'Data da entrega das chaves', 0.0, 0.0, 0, 0.0, 0.0, 0.0,
+                 [0.0] * len(taxas_extras), 0.0, saldo)
+
+    # ========== PÓS-ENTREGA ==========
+    post_nr = agenda["post_nr"]
+    tracker = PaymentTracker(dia_pagamento, I["taxa_pos"])
+    tracker.last_date = data_entrega
+    i = 0
+    prev_date = data_entrega
+    parcelas = 1
+    while saldo > 0 and parcelas <= 420:
+        d_evt = agenda["vencimentos"][parcelas - 1]
+        while i < len(post_nr) and post_nr[i]['data'] < d_evt:
+            ev = post_nr[i]
+            i += 1
+            if not ev['assoc'] and ev['data'] > prev_date:
+                saldo, row = extra_nao_associado(ev, tracker, saldo, False)
+                yield row
+        saldo, row = parcela_mensal(d_evt, tracker, saldo, False, I["capacidade_pos"], parcelas)
+        yield row
+        parcelas += 1
+        while i < len(post_nr) and post_nr[i]['data'] == d_evt:
+            ev = post_nr[i]
+            i += 1
+            if ev['assoc']:
+                saldo, row = associado(ev, d_evt, saldo)
+                yield row
+        prev_date = d_evt
+
+    return saldo, parcelas, fee
+
+
+def simular_fluxo(I, E, detalhado=True, agenda=None):
+    """Gera o fluxo completo (pré-entrega, entrega e pós-entrega) a partir dos dados do contrato.
+
+    Retorna um dict com `eventos`, `saldo` final, contador `parcelas` e a taxa `fee` do seguro
+    prestamista. As linhas vêm de `_linhas_fluxo`, o mesmo gerador de `gerar_linhas`. Com
+    `detalhado=False` (uso: resumos, metas, lotes) nenhuma linha é montada: pré e pós-entrega
+    rodam só com números (`_pre_entrega_rapido`, `_pos_entrega_rapido`) e, no lugar de
+    `eventos`, vem `saldo_entrega` (saldo após as taxas da entrega das chaves). `agenda` (de
+    `preparar_agenda`) evita refazer a expansão dos extras quando só as taxas mudam.
+
+    A referência é `referencia.fluxo_referencia` (cópia congelada do algoritmo original):
+    `benchmark.py` confere contra ela os dois modos, o streaming e a exportação.
+    """
+    if agenda is None:
+        agenda = preparar_agenda(I, E)
+
+    if detalhado:
+        eventos = [_linha_data_base(I)]
+        linhas = _linhas_fluxo(I, agenda)
+        while True:
+            try:
+                eventos.append(next(linhas))
+            except StopIteration as fim:
+                saldo, parcelas, fee = fim.value
+                break
+        return {'eventos': eventos, 'saldo': saldo, 'parcelas': parcelas, 'fee': fee}
+
+    taxas_extras = I["taxas_extras"]
+    data_entrega = I["data_entrega"]
+    pcts_pre = [t['pct'] for t in taxas_extras if t['periodo'] in ['pré-entrega da chave', 'ambos']]
+    pcts_pos = [t['pct'] for t in taxas_extras if t['periodo'] in ['pós-entrega da chave', 'ambos']]
+    saldo = _pre_entrega_rapido(I["valor_imovel"], agenda["pre_nr"], I["data_base"], I["data_inicio_pre"],
+                                data_entrega, I["dia_pagamento"], I["taxa_pre"], I["TAXA_INCC"], pcts_pre,
+                                I["capacidade_pre"])
+    saldo -= I["fgts"]
+    saldo -= I["fin_banco"]
+    for _, val in _taxas_entrega(I):
+        saldo += val
+    fee = saldo * taxa_em(I["TAXA_SEGURO_PRESTAMISTA_PCT"], data_entrega)
+    saldo += fee
+    saldo_entrega = saldo
+    saldo, parcelas = _pos_entrega_rapido(saldo, agenda["post_nr"], data_entrega, agenda["vencimentos"],
+                                          I["taxa_pos"], I["TAXA_IPCA"], pcts_pos, I["capacidade_pos"])
+    return {'saldo': saldo, 'parcelas': parcelas, 'fee': fee, 'saldo_entrega': saldo_entrega}
+
+
+def _taxas_entrega(I):
+    """Taxas fixas lançadas na entrega das chaves, na ordem do fluxo: [(nome, valor na data)]."""
+    ent = I["data_entrega"]
+    return [('Emissão CCB', taxa_em(I["TAXA_EMISSAO_CCB"], ent)),
+            ('Alienação Fiduciária', taxa_em(I["TAXA_EMISSAO_CONTRATO_ALIENACAO_FIDUCIARIA"], ent)),
+            ('Registro', taxa_em(I["TAXA_REGISTRO_IMOVEL"], ent)),
+            ('Escritura Imóvel', taxa_em(I["TAXA_ESCRITURA_IMOVEL"], ent))]
+
+
+def _pre_entrega_rapido(saldo, pre_nr, data_base, data_inicio_pre, data_entrega, dia_pagamento, taxa_pre, taxa_incc,
+                        pcts_pre, capacidade_pre):
+    """Pré-entrega só com números: devolve o saldo na entrega idêntico ao laço detalhado.
+
+    Mesmas operações de ponto flutuante, na mesma ordem, sem montar linhas; os extras são
+    consumidos por um ponteiro na lista ordenada, como em `_pos_entrega_rapido`.
+    """
+    last_date = data_base
+    prev_date = cursor = data_inicio_pre
+    i, n = 0, len(pre_nr)
+    while True:
+        d_evt = adjust_day(cursor, dia_pagamento)
+        if d_evt >= data_entrega:
+            break
+
+        # não-associados entre prev_date e d_evt (associados fora do dia da parcela são ignorados)
+        while i < n and pre_nr[i]['data'] < d_evt:
+            ev = pre_nr[i]
+            i += 1
+            if ev['assoc'] or ev['data'] <= prev_date:
+                continue
+            juros = saldo * (taxa_em(taxa_pre, ev['data']) * ((ev['data'] - last_date).days / 30))
+            total_taxas = sum([saldo * taxa_em(p, ev['data']) for p in pcts_pre]) + saldo * taxa_em(taxa_incc, ev['data'])
+            saldo -= ev['valor'] - juros - total_taxas
+            last_date = ev['data']
+
+        # parcela mensal
+        juros = saldo * (taxa_em(taxa_pre, d_evt) * ((d_evt - last_date).days / 30))
+        total_taxas = sum([saldo * taxa_em(p, d_evt) for p in pcts_pre]) + saldo * taxa_em(taxa_incc, d_evt)
+        saldo -= capacidade_pre - juros - total_taxas
+        last_date = d_evt
+
+        # associados do dia (não-associados na data exata da parcela nunca entram)
+        while i < n and pre_nr[i]['data'] == d_evt:
+            if pre_nr[i]['assoc']:
+                saldo -= pre_nr[i]['valor']
+            i += 1
+
+        prev_date = d_evt
+        cursor += relativedelta(months=1)
+    return saldo
+
+
+def _vencimento(data_ref, k, dia_pagamento):
+    """Data da k-ésima parcela mensal após `data_ref` (mesmo resultado de somar 1 mês k vezes + adjust_day)."""
+    ano, mes = divmod(data_ref.year * 12 + data_ref.month - 1 + k, 12)
+    mes += 1
+    return data_ref.replace(year=ano, month=mes, day=min(dia_pagamento, calendar.monthrange(ano, mes)[1]))
+
+
+def _pos_entrega_rapido(saldo, post_nr, data_entrega, vencimentos, taxa_pos, taxa_ipca, pcts_pos, capacidade_pos):
+    """Pós-entrega só com números: devolve (saldo, parcelas) idênticos ao laço detalhado.
+
+    Mesmas operações de ponto flutuante, na mesma ordem, sem montar linhas. Os extras são
+    consumidos por um ponteiro na lista ordenada. Depois do último extra a recorrência fica
+    estável: com taxas escalares, as taxas são lidas uma vez e os fatores de juros de cada mês
+    saem da grade de vencimentos, restando só a conta do saldo até zerar ou 420 parcelas.
+    `vencimentos[k - 1]` é a data da k-ésima parcela.
+    """
+    last_date = data_entrega
+    prev_date = data_entrega
+    parcelas = 1
+    i, n = 0, len(post_nr)
+
+    # Trecho com extras pendentes
+    while i < n and saldo > 0 and parcelas <= 420:
+        d_evt = vencimentos[parcelas - 1]
+
+        # não-associados entre prev_date e d_evt (associados fora do dia da parcela são ignorados)
+        while i < n and post_nr[i]['data'] < d_evt:
+            ev = post_nr[i]
+            i += 1
+            if ev['assoc'] or ev['data'] <= prev_date:
+                continue
+            juros = saldo * (taxa_em(taxa_pos, ev['data']) * ((ev['data'] - last_date).days / 30))
+            total_taxas = sum([saldo * taxa_em(p, ev['data']) for p in pcts_pos]) + saldo * taxa_em(taxa_ipca, ev['data'])
+            saldo -= ev['valor'] - juros - total_taxas
+            last_date = ev['data']
+
+        # parcela mensal
+        juros = saldo * (taxa_em(taxa_pos, d_evt) * ((d_evt - last_date).days / 30))
+        total_taxas = sum([saldo * taxa_em(p, d_evt) for p in pcts_pos]) + saldo * taxa_em(taxa_ipca, d_evt)
+        saldo -= capacidade_pos - juros - total_taxas
+        last_date = d_evt
+        parcelas += 1
+
+        # associados do dia (não-associados na data exata da parcela nunca entram)
+        while i < n and post_nr[i]['data'] == d_evt:
+            if post_nr[i]['assoc']:
+                saldo -= post_nr[i]['valor']
+            i += 1
+
+        prev_date = d_evt
+
+    # Cauda estável: nenhum extra restante
+    if any(isinstance(t, SerieTaxa) for t in (taxa_pos, taxa_ipca, *pcts_pos)):
+        while saldo > 0 and parcelas <= 420:
+            d_evt = vencimentos[parcelas - 1]
+            juros = saldo * (taxa_em(taxa_pos, d_evt) * ((d_evt - last_date).days / 30))
+            total_taxas = sum([saldo * taxa_em(p, d_evt) for p in pcts_pos]) + saldo * taxa_em(taxa_ipca, d_evt)
+            saldo -= capacidade_pos - juros - total_taxas
+            last_date = d_evt
+            parcelas += 1
+        return saldo, parcelas
+
+    # Taxas escalares: nada é consultado por mês. Os fatores de juros saem da grade de dias, e a
+    # soma das taxas extras só monta lista quando há duas ou mais (sum([]) + x == x e
+    # sum([a]) + x == a + x exatamente; com 2+ termos o sum() é mantido pela ordem de arredondamento).
+    dias = [(d - a).days for a, d in zip([last_date] + vencimentos[parcelas - 1:], vencimentos[parcelas - 1:])]
+    fatores = [taxa_pos * (d / 30) for d in dias]
+    k = 0
+    if not pcts_pos:
+        while saldo > 0 and parcelas <= 420:
+            saldo -= capacidade_pos - saldo * fatores[k] - saldo * taxa_ipca
+            k += 1
+            parcelas += 1
+    elif len(pcts_pos) == 1:
+        pct = pcts_pos[0]
+        while saldo > 0 and parcelas <= 420:
+            saldo -= capacidade_pos - saldo * fatores[k] - (saldo * pct + saldo * taxa_ipca)
+            k += 1
+            parcelas += 1
+    else:
+        while saldo > 0 and parcelas <= 420:
+            saldo -= capacidade_pos - saldo * fatores[k] - (sum([saldo * p for p in pcts_pos]) + saldo * taxa_ipca)
+            k += 1
+            parcelas += 1
+
+    return saldo, parcelas
+
+
+def rotular_parcelas(eventos):
+    """Ordena os eventos por data e rotula as parcelas semestrais/anuais como k/N."""
+    def _is_semi(t):   return str(t).startswith("Pagamento Semestral")
+    def _is_annual(t): return str(t).startswith("Pagamento Anual")
+
+    eventos_sorted = sorted(eventos, key=lambda x: x['data'])
+
+    semi_idxs   = [i for i,ev in enumerate(eventos_sorted) if _is_semi(ev['tipo'])]
+    annual_idxs = [i for i,ev in enumerate(eventos_sorted) if _is_annual(ev['tipo'])]
+
+    semi_N   = len(semi_idxs)
+    annual_N = len(annual_idxs)
+
+    # zera 'parcela' textual para não conflitar com parcelas mensais (inteiros)
+    for ev in eventos_sorted:
+        if not isinstance(ev.get('parcela',''), int):
+            ev['parcela'] = ''
+
+    for k, i in enumerate(semi_idxs, start=1):
+        eventos_sorted[i]['parcela'] = f"{k}/{semi_N}" if semi_N else ''
+    for k, i in enumerate(annual_idxs, start=1):
+        eventos_sorted[i]['parcela'] = f"{k}/{annual_N}" if annual_N else ''
+
+    return eventos_sorted
+
+def _totais_series(I, agenda, parcelas):
+    """Denominadores N do rótulo k/N (semestrais, anuais) sem simular valores.
+
+    Repete só as janelas de data do motor: não-associados entre a parcela anterior e a atual,
+    associados exatamente no dia da parcela. O pós-entrega vai até a parcela `parcelas - 1`
+    (o contador final do modo resumo).
+    """
+    dia_pagamento = I["dia_pagamento"]
+    data_entrega = I["data_entrega"]
+    efetivos = []
+
+    def janela(lista, i, prev_date, d_evt):
+        while i < len(lista) and lista[i]['data'] < d_evt:
+            if not lista[i]['assoc'] and lista[i]['data'] > prev_date:
+                efetivos.append(lista[i]['tipo'])
+            i += 1
+        while i < len(lista) and lista[i]['data'] == d_evt:
+            if lista[i]['assoc']:
+                efetivos.append(lista[i]['tipo'])
+            i += 1
+        return i
+
+    i = 0
+    prev_date = cursor = I["data_inicio_pre"]
+    while True:
+        d_evt = adjust_day(cursor, dia_pagamento)
+        if d_evt >= data_entrega:
+            break
+        i = janela(agenda["pre_nr"], i, prev_date, d_evt)
+        prev_date = d_evt
+        cursor += relativedelta(months=1)
+
+    i = 0
+    prev_date = data_entrega
+    for d_evt in agenda["vencimentos"][:parcelas - 1]:
+        i = janela(agenda["post_nr"], i, prev_date, d_evt)
+        prev_date = d_evt
+
+    semi_N = sum(1 for t in efetivos if str(t).startswith("Pagamento Semestral"))
+    annual_N = sum(1 for t in efetivos if str(t).startswith("Pagamento Anual"))
+    return semi_N, annual_N
+
+
+def gerar_linhas(I, E, agenda=None, parcelas=None):
+    """Gera as linhas do fluxo uma a uma, já em ordem de data e com o rótulo k/N.
+
+    Mesmo motor de `simular_fluxo` (`_linhas_fluxo`) + `rotular_parcelas`, sem guardar a lista:
+    o horizonte `parcelas` vem do modo resumo (calculado se omitido) e os N de `_totais_series`,
+    então cada linha sai pronta. A única linha retida é a da data-base, até chegar a sua vez.
+    """
+    if agenda is None:
+        agenda = preparar_agenda(I, E)
+    if parcelas is None:
+        parcelas = simular_fluxo(I, E, detalhado=False, agenda=agenda)["parcelas"]
+    semi_N, annual_N = _totais_series(I, agenda, parcelas)
+
+    # Data-base entra antes da primeira linha com data >= data_base (mesma posição do sort estável)
+    base = _linha_data_base(I)
+    semi_k = annual_k = 0
+    for ev in _linhas_fluxo(I, agenda):
+        if base is not None and ev['data'] >= base['data']:
+            yield base
+            base = None
+        if str(ev['tipo']).startswith("Pagamento Semestral"):
+            semi_k += 1
+            ev['parcela'] = f"{semi_k}/{semi_N}"
+        elif str(ev['tipo']).startswith("Pagamento Anual"):
+            annual_k += 1
+            ev['parcela'] = f"{annual_k}/{annual_N}"
+        yield ev
+    if base is not None:
+        yield base
+
+
+# ==========================
+# Planilha e comparação
+# ==========================
+def _cabecalho(taxas_extras):
+    headers = ["Data","Parcela","Tipo","Dias no Mês","Dias Corridos","Taxa Efetiva","Valor Pago (R$)",
+               "Juros (R$)"]
+    headers += [f"Taxa {i+1} (R$)" for i in range(len(taxas_extras))]
+    headers += ["Total de adições e subtrações (R$)","Saldo Devedor (R$)"]
+    return headers
+
+def _linha_planilha(ev):
+    row = [
+        ev['data'],
+        ev.get('parcela', ''),
+        ev['tipo'],
+        days_in_month(ev['data']),
+        ev.get('dias_corridos', ''),
+        ev.get('taxa_efetiva', ''),
+        ev.get('valor', 0),
+        ev.get('juros', 0),
+    ]
+    return row + ev.get('taxas_extra', []) + [ev.get('Total de mudança (R$)', 0), ev.get('saldo', 0)]
+
+def _formato_coluna(h):
+    if h == "Data":
+        return DATE_FORMAT
+    elif h in ["Parcela", "Dias no Mês", "Dias Corridos"]:
+        return '0'
+    elif h == "Taxa Efetiva":
+        return PERCENT_FORMAT
+    return CURRENCY_FORMAT
+
+def montar_aba(ws, I, fluxo, eventos_sorted):
+    """Escreve o fluxo (cabeçalho, linhas, totais e formatação) na aba `ws` da planilha."""
+    valor_imovel = I["valor_imovel"]
+    taxas_extras = I["taxas_extras"]
+    TAXA_EMISSAO_CCB = taxa_em(I["TAXA_EMISSAO_CCB"], I["data_entrega"])
+    TAXA_EMISSAO_CONTRATO_ALIENACAO_FIDUCIARIA = taxa_em(I["TAXA_EMISSAO_CONTRATO_ALIENACAO_FIDUCIARIA"], I["data_entrega"])
+    TAXA_REGISTRO_IMOVEL = taxa_em(I["TAXA_REGISTRO_IMOVEL"], I["data_entrega"])
+    TAXA_ESCRITURA_IMOVEL = taxa_em(I["TAXA_ESCRITURA_IMOVEL"], I["data_entrega"])
+    eventos = fluxo["eventos"]
+    fee = fluxo["fee"]
+
+    headers = _cabecalho(taxas_extras)
+
+    # Cabeçalho
+    for i, h in enumerate(headers, 1):
+        cell = ws.cell(row=1, column=i, value=h)
+        cell.fill = HEADER_FILL
+        cell.font = Font(bold=True)
+
+    # Linha inicial (saldo)
+    ws.append(["-"]*(len(headers)-1) + [valor_imovel])
+
+    # Eventos ordenados
+    for ev in eventos_sorted:
+        ws.append(_linha_planilha(ev))
+
+    # Linha em branco
+    ws.append([''] * len(headers))
+
+    # Totais
+    soma_total = (sum(ev['valor'] for ev in eventos if isinstance(ev['valor'], (int, float))))+ (TAXA_EMISSAO_CCB + TAXA_EMISSAO_CONTRATO_ALIENACAO_FIDUCIARIA + TAXA_REGISTRO_IMOVEL + TAXA_ESCRITURA_IMOVEL + fee)
+    soma_juros = (sum(ev['juros']for ev in eventos if isinstance(ev['valor'], (int, float))))
+    ws.append(['TOTAIS', '', '', '', '', '', soma_total, soma_juros])
+    totals_row = ws.max_row
+    ws.cell(row=totals_row, column=1).fill = HEADER_FILL
+    ws.cell(row=totals_row, column=1).font = Font(bold=True)
+
+    # Negrito em todas as células da linha de totais + borda pontilhada acima
+    for col_idx in range(1, len(headers) + 1):
+        cell = ws.cell(row=totals_row, column=col_idx)
+        cell.font = Font(bold=True)
+        # preserva bordas existentes e adiciona top pontilhada
+        cell.border = Border(
+            left=cell.border.left,
+            right=cell.border.right,
+            bottom=cell.border.bottom,
+            top=Side(style="dotted", color="FF000000")
+        )
+
+    # Ajuste largura
+    for col_cells in ws.columns:
+        max_length = 0
+        column = get_column_letter(col_cells[0].column)
+        for cell in col_cells:
+            if cell.value is not None:
+                max_length = max(max_length, len(str(cell.value)))
+        ws.column_dimensions[column].width = max_length + 2
+
+    # Formatos
+    for col_idx, h in enumerate(headers, start=1):
+        formato = _formato_coluna(h)
+        for row_idx in range(2, ws.max_row + 1):
+            ws.cell(row=row_idx, column=col_idx).number_format = formato
+
+    # Coloração por sinal na coluna "Total de adições e subtrações (R$)"
+    total_col_idx = headers.index("Total de adições e subtrações (R$)") + 1
+    for row_idx in range(2, ws.max_row + 1):
+        cell = ws.cell(row=row_idx, column=total_col_idx)
+        try:
+            val = float(cell.value)
+            if val < 0:  # abatimento => verde
+                cell.font = Font(color=GREEN_COLOR)
+            elif val > 0:  # adição => vermelho
+                cell.font = Font(color=RED_COLOR)
+        except (TypeError, ValueError):
+            pass
+
+
+def comparar_empreendimentos(I, E, taxas_por_emp: dict, nomes=None, agenda=None) -> list:
+    """Roda os mesmos dados do cliente contra vários blocos do taxas.txt, em modo resumo.
+
+    A agenda (extras expandidos e vencimentos) é montada uma única vez e compartilhada entre os
+    empreendimentos; cada um custa só o laço numérico. Passe `agenda` para reaproveitá-la também
+    em `planilha_comparacao`. Devolve uma linha (dict) por empreendimento.
+    """
+    if agenda is None:
+        agenda = preparar_agenda(I, E)
+    linhas = []
+    for nome in (nomes or list(taxas_por_emp.keys())):
+        taxas_sel = taxas_por_emp.get(nome, {})
+        I_emp = {**I, "empreendimento": nome, "taxas_sel": taxas_sel, **taxas_do_empreendimento(taxas_sel)}
+        fluxo = simular_fluxo(I_emp, E, detalhado=False, agenda=agenda)
+        excede = fluxo["parcelas"] >= 420 and fluxo["saldo"] > 0
+        linhas.append({
+            "Empreendimento": nome,
+            "Saldo após a entrega (R$)": fluxo["saldo_entrega"],
+            "Seguro Prestamista (R$)": fluxo["fee"],
+            "Parcelas pós-entrega": fluxo["parcelas"] - 1,
+            "Saldo final (R$)": fluxo["saldo"],
+            "Situação": "Excede 420 parcelas" if excede else "Viável",
+        })
+    return linhas
+
+
+def planilha_comparacao(I, E, taxas_por_emp: dict, linhas: list, agenda=None) -> Workbook:
+    """Planilha com a aba "Comparação" e uma aba detalhada por empreendimento de `linhas`."""
+    if agenda is None:
+        agenda = preparar_agenda(I, E)
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Comparação"
+    headers = list(linhas[0].keys()) if linhas else ["Empreendimento"]
+    for i, h in enumerate(headers, 1):
+        cell = ws.cell(row=1, column=i, value=h)
+        cell.fill = HEADER_FILL
+        cell.font = Font(bold=True)
+    for linha in linhas:
+        ws.append([linha[h] for h in headers])
+    for col_idx, h in enumerate(headers, start=1):
+        ws.column_dimensions[get_column_letter(col_idx)].width = max(len(h), 16) + 2
+        if h.endswith("(R$)"):
+            for row_idx in range(2, ws.max_row + 1):
+                ws.cell(row=row_idx, column=col_idx).number_format = CURRENCY_FORMAT
+
+    usados = {ws.title}
+    for linha in linhas:
+        nome = linha["Empreendimento"]
+        taxas_sel = taxas_por_emp.get(nome, {})
+        I_emp = {**I, "empreendimento": nome, "taxas_sel": taxas_sel, **taxas_do_empreendimento(taxas_sel)}
+        fluxo = simular_fluxo(I_emp, E, agenda=agenda)
+        base = "".join(c for c in nome if c not in '[]:*?/\\')[:31] or "Empreendimento"
+        titulo, k = base, 2
+        while titulo in usados:
+            sufixo = f" ({k})"
+            titulo = base[:31 - len(sufixo)] + sufixo
+            k += 1
+        usados.add(titulo)
+        montar_aba(wb.create_sheet(titulo), I_emp, fluxo, rotular_parcelas(fluxo["eventos"]))
+    return wb
+
+
+# sum() de floats usa soma compensada (Neumaier) a partir do Python 3.12
+_SUM_COMPENSADO = sum([1e100, 1.0, -1e100]) == 1.0
+
+class _Soma:
+    """Acumulador incremental com o mesmo resultado de `sum()` sobre os mesmos floats, na mesma ordem.
+
+    Os totais em streaming precisam bater com os `sum(...)` de `montar_aba` sem guardar as linhas.
+    """
+    def __init__(self):
+        self.s = 0.0
+        self.c = 0.0
+    def add(self, x):
+        t = self.s + x
+        if _SUM_COMPENSADO:
+            if abs(self.s) >= abs(x):
+                self.c += (self.s - t) + x
+            else:
+                self.c += (x - t) + self.s
+        self.s = t
+    def total(self):
+        if self.c and math.isfinite(self.c):
+            return self.s + self.c
+        return self.s
+
+
+def exportar_fluxo(I, E, destino, formato="xlsx", agenda=None):
+    """Grava o fluxo direto em `destino` (caminho ou arquivo aberto), linha a linha.
+
+    As linhas vêm de `gerar_linhas` e vão para uma planilha write-only do openpyxl ("xlsx") ou
+    para um CSV ("csv", `destino` em texto), sem montar a lista de eventos nem a planilha em
+    memória; do modo resumo ficam só os números (`saldo`, `parcelas`, `fee`), então a memória
+    não cresce com o tamanho do fluxo. Larguras de coluna são fixas (não há como medir o conteúdo
+    antes). Devolve esse resumo.
+    """
+    if formato not in ("xlsx", "csv"):
+        raise ValueError(f"Formato de exportação desconhecido: {formato}")
+    if agenda is None:
+        agenda = preparar_agenda(I, E)
+    resumo = {k: v for k, v in simular_fluxo(I, E, detalhado=False, agenda=agenda).items()
+              if k in ("saldo", "parcelas", "fee")}
+    headers = _cabecalho(I["taxas_extras"])
+    # mesma expressão (e ordem) da linha TOTAIS de `montar_aba`
+    ccb, alienacao, registro, escritura = (val for _, val in _taxas_entrega(I))
+    taxas_entrega = ccb + alienacao + registro + escritura + resumo["fee"]
+    soma_valor, soma_juros = _Soma(), _Soma()
+
+    if formato == "csv":
+        with (open(destino, "w", encoding="utf-8-sig", newline="") if isinstance(destino, (str, Path))
+              else nullcontext(destino)) as f:
+            w = csv.writer(f)
+            w.writerow(headers)
+            w.writerow(["-"] * (len(headers) - 1) + [I["valor_imovel"]])
+            for ev in gerar_linhas(I, E, agenda=agenda, parcelas=resumo["parcelas"]):
+                soma_valor.add(ev['valor'])
+                soma_juros.add(ev['juros'])
+                row = _linha_planilha(ev)
+                row[0] = ev['data'].strftime("%d/%m/%Y")
+                w.writerow(row)
+            w.writerow([''] * len(headers))
+            w.writerow(['TOTAIS', '', '', '', '', '', soma_valor.total() + taxas_entrega, soma_juros.total()])
+        return resumo
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(f"Financ-{I['cliente']}"[:31])
+    for col_idx, h in enumerate(headers, start=1):
+        ws.column_dimensions[get_column_letter(col_idx)].width = max(len(h), 12) + 2
+    formatos = [_formato_coluna(h) for h in headers]
+    total_col = headers.index("Total de adições e subtrações (R$)")
+    cores = {-1: Font(color=GREEN_COLOR), 1: Font(color=RED_COLOR)}
+
+    def celula(valor, idx, font=None, fill=None):
+        cell = WriteOnlyCell(ws, value=valor)
+        cell.number_format = formatos[idx]
+        if font is not None:
+            cell.font = font
+        if fill is not None:
+            cell.fill = fill
+        return cell
+
+    cabecalho = []
+    for h in headers:
+        cell = WriteOnlyCell(ws, value=h)
+        cell.fill = HEADER_FILL
+        cell.font = Font(bold=True)
+        cabecalho.append(cell)
+    ws.append(cabecalho)
+    ws.append([celula(v, i) for i, v in enumerate(["-"] * (len(headers) - 1) + [I["valor_imovel"]])])
+    for ev in gerar_linhas(I, E, agenda=agenda, parcelas=resumo["parcelas"]):
+        soma_valor.add(ev['valor'])
+        soma_juros.add(ev['juros'])
+        row = _linha_planilha(ev)
+        mudanca = row[total_col]
+        sinal = (mudanca > 0) - (mudanca < 0) if isinstance(mudanca, (int, float)) else 0
+        ws.append([celula(v, i, cores.get(sinal) if i == total_col else None) for i, v in enumerate(row)])
+    ws.append([celula('', i) for i in range(len(headers))])
+    totais = ['TOTAIS', '', '', '', '', '', soma_valor.total() + taxas_entrega, soma_juros.total()]
+    totais += [''] * (len(headers) - len(totais))
+    negrito = Font(bold=True)
+    borda = Border(top=Side(style="dotted", color="FF000000"))
+    linha_totais = []
+    for i, v in enumerate(totais):
+        cell = celula(v, i, negrito, HEADER_FILL if i == 0 else None)
+        cell.border = borda
+        linha_totais.append(cell)
+    ws.append(linha_totais)
+    wb.save(destino)
+    return resumo
+
+
+def exportar_lote(propostas, caminho_zip, formato="csv"):
+    """Exporta vários contratos para um .zip, um arquivo por contrato, gravando cada entrada em fluxo.
+
+    `propostas` é um iterável (pode ser gerador) de tuplas `(nome, I, E)`. Nomes repetidos
+    ganham sufixo " (2)", " (3)"... Devolve uma lista de dicts com nome, arquivo no .zip, saldo
+    final e parcelas de cada contrato.
+    """
+    resumos = []
+    usados = set()
+    with zipfile.ZipFile(caminho_zip, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for nome, I, E in propostas:
+            arquivo, k = f"{nome}.{formato}", 2
+            while arquivo in usados:
+                arquivo = f"{nome} ({k}).{formato}"
+                k += 1
+            usados.add(arquivo)
+            with zf.open(arquivo, "w", force_zip64=True) as bruto:
+                if formato == "csv":
+                    with TextIOWrapper(bruto, encoding="utf-8-sig", newline="") as texto:
+                        resumo = exportar_fluxo(I, E, texto, formato)
+                else:
+                    resumo = exportar_fluxo(I, E, bruto, formato)
+            resumos.append({"nome": nome, "arquivo": arquivo, "saldo": resumo["saldo"], "parcelas": resumo["parcelas"]})
+    return resumos
+
+
 def login_screen():
     # --- CSS para centralizar a imagem e sobrepor o título ---
     try:
@@ -251,22 +1191,7 @@ def app_body():
 
         # Extrai taxas do empreendimento escolhido
         taxas_sel = taxas_por_emp.get(empreendimento, {})
-        TAXA_EMISSAO_CCB = taxas_sel.get('TAXA_EMISSAO_CCB', 0.0)
-        TAXA_EMISSAO_CONTRATO_ALIENACAO_FIDUCIARIA = taxas_sel.get('TAXA_EMISSAO_CONTRATO_ALIENACAO_FIDUCIARIA', 0.0)
-        TAXA_REGISTRO_IMOVEL = taxas_sel.get('TAXA_REGISTRO_IMOVEL', 0.0)
-        TAXA_ESCRITURA_IMOVEL = taxas_sel.get('TAXA_ESCRITURA_IMOVEL', 0.0)
-        TAXA_SEGURO_PRESTAMISTA_PCT = taxas_sel.get('TAXA_SEGURO_PRESTAMISTA_PCT', 0.0)
-        TAXA_INCC = taxas_sel.get('TAXA_INCC', 0.0)
-        TAXA_IPCA = taxas_sel.get('TAXA_IPCA', 0.0)
-        taxa_pre = taxas_sel.get('taxa_pre', 0.0)
-        taxa_pos = taxas_sel.get('taxa_pos', 0.0)
-
-        # Extras percentuais
-        taxas_extras = []
-        for chave, val in taxas_sel.items():
-            if chave.endswith('_PCT') and chave not in ['TAXA_SEGURO_PRESTAMISTA_PCT']:
-                periodo = 'pré-entrega da chave' if 'INCC' in chave else 'pós-entrega da chave'
-                taxas_extras.append({'pct': val, 'periodo': periodo})
+        taxas_emp = taxas_do_empreendimento(taxas_sel)
 
         st.markdown("### Datas-chave")
         cold1, cold2 = st.columns(2)
@@ -304,16 +1229,7 @@ def app_body():
             "valor_imovel": valor_imovel,
             "empreendimento": empreendimento,
             "taxas_sel": taxas_sel,
-            "TAXA_EMISSAO_CCB": TAXA_EMISSAO_CCB,
-            "TAXA_EMISSAO_CONTRATO_ALIENACAO_FIDUCIARIA": TAXA_EMISSAO_CONTRATO_ALIENACAO_FIDUCIARIA,
-            "TAXA_REGISTRO_IMOVEL": TAXA_REGISTRO_IMOVEL,
-            "TAXA_ESCRITURA_IMOVEL": TAXA_ESCRITURA_IMOVEL,
-            "TAXA_SEGURO_PRESTAMISTA_PCT": TAXA_SEGURO_PRESTAMISTA_PCT,
-            "TAXA_INCC": TAXA_INCC,
-            "TAXA_IPCA": TAXA_IPCA,
-            "taxa_pre": taxa_pre,
-            "taxa_pos": taxa_pos,
-            "taxas_extras": taxas_extras,
+            **taxas_emp,
             "data_base": data_base,
             "data_inicio_pre": data_inicio_pre,
             "data_entrega": data_entrega,
@@ -386,344 +1302,17 @@ def app_body():
                 E = st.session_state.get("extras", {"non_rec": [], "semi_series": [], "annual_series": []})
 
                 cliente = I["cliente"]
-                dia_pagamento = I["dia_pagamento"]
-                valor_imovel = I["valor_imovel"]
-                TAXA_EMISSAO_CCB = I["TAXA_EMISSAO_CCB"]
-                TAXA_EMISSAO_CONTRATO_ALIENACAO_FIDUCIARIA = I["TAXA_EMISSAO_CONTRATO_ALIENACAO_FIDUCIARIA"]
-                TAXA_REGISTRO_IMOVEL = I["TAXA_REGISTRO_IMOVEL"]
-                TAXA_ESCRITURA_IMOVEL = I["TAXA_ESCRITURA_IMOVEL"]
-                TAXA_SEGURO_PRESTAMISTA_PCT = I["TAXA_SEGURO_PRESTAMISTA_PCT"]
-                TAXA_INCC = I["TAXA_INCC"]
-                TAXA_IPCA = I["TAXA_IPCA"]
-                taxa_pre = I["taxa_pre"]
-                taxa_pos = I["taxa_pos"]
-                taxas_extras = I["taxas_extras"]
-                data_base = I["data_base"]
-                data_inicio_pre = I["data_inicio_pre"]
-                data_entrega = I["data_entrega"]
-                capacidade_pre = I["capacidade_pre"]
-                capacidade_pos_antes = I["capacidade_pos_antes"]
-                val_parcela_banco = I["val_parcela_banco"]
-                capacidade_pos = I["capacidade_pos"]
-                fgts = I["fgts"]
-                fin_banco = I["fin_banco"]
-
-                # Copia listas de extras
-                non_rec = list(E["non_rec"])
-                semi_series = list(E["semi_series"])
-                annual_series = list(E["annual_series"])
-
-                # Agrega séries recorrentes (gera agenda bruta)
-                for series in semi_series:
-                    for n in range(100):
-                        d = series['d0'] + relativedelta(months=6 * n)
-                        if series['assoc']:
-                            d = adjust_day(d, dia_pagamento)
-                        non_rec.append({'data': d, 'tipo': 'Pagamento Semestral', 'valor': series['v'], 'assoc': series['assoc']})
-                for series in annual_series:
-                    for n in range(100):
-                        d = series['d0'] + relativedelta(years=n)
-                        if series['assoc']:
-                            d = adjust_day(d, dia_pagamento)
-                        non_rec.append({'data': d, 'tipo': 'Pagamento Anual', 'valor': series['v'], 'assoc': series['assoc']})
-
-                # Separa pré/pós
-                pre_nr = sorted([e for e in non_rec if e['data'] < data_entrega], key=lambda x: x['data'])
-                post_nr = sorted([e for e in non_rec if e['data'] >= data_entrega], key=lambda x: x['data'])
-
-                # Coletores
-                eventos = []
-                saldo = valor_imovel
-
-                # Contagem de parcelas especiais (para exibir k/N)
-                semi_total = len([e for e in non_rec if e['tipo'] == 'Pagamento Semestral'])
-                annual_total = len([e for e in non_rec if e['tipo'] == 'Pagamento Anual'])
-                semi_seq = 0
-                annual_seq = 0
-
-                # Data base
-                eventos.append({
-                    'data': data_base, 'parcela': '', 'tipo': 'Data-Base (assinatura do contrato)',
-                    'valor': 0.0, 'juros': 0.0, 'dias_corridos': 0, 'taxa_efetiva': 0.0,
-                    'incc': 0.0, 'ipca': 0.0, 'taxas_extra': [0.0] * len(taxas_extras),
-                    'Total de mudança (R$)': 0.0, 'saldo': saldo
-                })
-
-                # ========== PRÉ-ENTREGA ==========
-                tracker_pre = PaymentTracker(dia_pagamento, taxa_pre)
-                tracker_pre.last_date = data_base
-
-                prev_date = data_inicio_pre
-                cursor = data_inicio_pre
-                while True:
-                    d_evt = adjust_day(cursor, dia_pagamento)
-                    if d_evt >= data_entrega:
-                        break
-
-                    # (a) não-associados entre prev_date e d_evt — seguem iguais
-                    for ev_nr in [e for e in pre_nr if not e['assoc'] and prev_date < e['data'] < d_evt]:
-                        juros, dias_corr, taxa_eff = tracker_pre.calculate(ev_nr['data'], saldo)
-                        incc_nr = saldo * TAXA_INCC
-                        extras_nr = [saldo * t['pct'] if t['periodo'] in ['pré-entrega da chave', 'ambos'] else 0.0 for t in taxas_extras]
-                        total_taxas_nr = sum(extras_nr) + incc_nr
-                        abat_nr = ev_nr['valor'] - juros - total_taxas_nr
-                        saldo -= abat_nr
-                        eventos.append({
-                            'data': ev_nr['data'], 'parcela': '', 'tipo': ev_nr['tipo'], 'valor': ev_nr['valor'],
-                            'juros': juros, 'dias_corridos': dias_corr, 'taxa_efetiva': taxa_eff,
-                            'incc': incc_nr, 'ipca': 0.0, 'taxas_extra': extras_nr,
-                            'Total de mudança (R$)': -abat_nr, 'saldo': saldo
-                        })
-
-                    # >>> ORDEM CORRETA A PARTIR DAQUI <<<
-
-                    # (b) parcela mensal pré — calcula encargos ANTES dos associados
-                    juros, dias_corr, taxa_eff = tracker_pre.calculate(d_evt, saldo)
-                    incc = saldo * TAXA_INCC
-                    extras = [saldo * t['pct'] if t['periodo'] in ['pré-entrega da chave', 'ambos'] else 0.0 for t in taxas_extras]
-                    total_taxas = sum(extras) + incc
-                    valor_total = capacidade_pre
-                    abat_mes = valor_total - juros - total_taxas
-                    saldo -= abat_mes
-                    eventos.append({
-                        'data': d_evt, 'parcela': '', 'tipo': 'Pré-Entrega', 'valor': valor_total,
-                        'juros': juros, 'dias_corridos': dias_corr, 'taxa_efetiva': taxa_eff,
-                        'incc': incc, 'ipca': 0.0, 'taxas_extra': extras,
-                        'Total de mudança (R$)': -abat_mes, 'saldo': saldo
-                    })
-
-                    # (c) associados do dia — linhas separadas, zerando encargos, DEPOIS da parcela
-                    associados = [e for e in pre_nr if e['assoc'] and e['data'] == d_evt]
-                    for ev_as in associados:
-                        abat_assoc = ev_as['valor']  # 100% para principal
-                        saldo -= abat_assoc
-                        eventos.append({
-                            'data': d_evt, 'parcela': '', 'tipo': ev_as['tipo'] + " (Associado)", 'valor': ev_as['valor'],
-                            'juros': 0.0, 'dias_corridos': 0, 'taxa_efetiva': 0.0,
-                            'incc': 0.0, 'ipca': 0.0, 'taxas_extra': [0.0]*len(taxas_extras),
-                            'Total de mudança (R$)': -abat_assoc, 'saldo': saldo
-                        })
-
-                    prev_date = d_evt
-                    cursor += relativedelta(months=1)
-
-
-                # ========== ENTREGA ==========
-                ent = data_entrega
-                zero_extras = [0.0] * len(taxas_extras)
-
-                for desc, v in [('Abatimento FGTS', fgts), ('Abatimento Fin. Banco', fin_banco)]:
-                    saldo -= v
-                    eventos.append({
-                        'data': ent, 'parcela': '', 'tipo': desc, 'valor': 0.0,
-                        'juros': 0.0, 'dias_corridos': '', 'taxa_efetiva': '',
-                        'incc': 0.0, 'ipca': 0.0, 'taxas_extra': zero_extras,
-                        'Total de mudança (R$)': -v,  # abatimento => negativo
-                        'saldo': saldo
-                    })
-
-                for nome, val in [('Emissão CCB', TAXA_EMISSAO_CCB),
-                                  ('Alienação Fiduciária', TAXA_EMISSAO_CONTRATO_ALIENACAO_FIDUCIARIA),
-                                  ('Registro', TAXA_REGISTRO_IMOVEL),
-                                  ('Escritura Imóvel', TAXA_ESCRITURA_IMOVEL)]:
-                    saldo += val
-                    eventos.append({
-                        'data': ent, 'parcela': '', 'tipo': 'Taxa ' + nome, 'valor': 0.0,
-                        'juros': 0.0, 'dias_corridos': '', 'taxa_efetiva': '',
-                        'incc': 0.0, 'ipca': 0.0, 'taxas_extra': zero_extras,
-                        'Total de mudança (R$)': val,  # adiciona saldo => positivo
-                        'saldo': saldo
-                    })
-
-                fee = saldo * TAXA_SEGURO_PRESTAMISTA_PCT
-                saldo += fee
-                eventos.append({
-                    'data': ent, 'parcela': '', 'tipo': 'Taxa Seguro Prestamista', 'valor': 0.0,
-                    'juros': 0.0, 'dias_corridos': '', 'taxa_efetiva': '',
-                    'incc': 0.0, 'ipca': 0.0, 'taxas_extra': zero_extras,
-                    'Total de mudança (R$)': fee,  # adiciona saldo => positivo
-                    'saldo': saldo
-                })
-
-                eventos.append({
-                    'data': ent, 'parcela': '', 'tipo': 'Data da entrega das chaves', 'valor': 0.0,
-                    'juros': 0.0, 'dias_corridos': 0, 'taxa_efetiva': 0.0,
-                    'incc': 0.0, 'ipca': 0.0, 'taxas_extra': [0.0]*len(taxas_extras),
-                    'Total de mudança (R$)': 0.0, 'saldo': saldo
-                })
-
-                # ========== PÓS-ENTREGA ==========
-                tracker_pos = PaymentTracker(dia_pagamento, taxa_pos)
-                tracker_pos.last_date = data_entrega
-                prev_date = data_entrega
-                cursor = data_entrega
-                parcelas = 1
-
-                while saldo > 0 and parcelas <= 420:
-                    d_evt = adjust_day(cursor + relativedelta(months=1), dia_pagamento)
-
-                    # (a) não-associados entre prev_date e d_evt — seguem iguais
-                    for ev_nr in [e for e in post_nr if not e['assoc'] and prev_date < e['data'] < d_evt]:
-                        juros, dias_corr, taxa_eff = tracker_pos.calculate(ev_nr['data'], saldo)
-                        ipca_nr = saldo * TAXA_IPCA
-                        extras_nr = [saldo * t['pct'] if t['periodo'] in ['pós-entrega da chave', 'ambos'] else 0.0 for t in taxas_extras]
-                        total_taxas_nr = sum(extras_nr) + ipca_nr
-                        abat_nr = ev_nr['valor'] - juros - total_taxas_nr
-                        saldo -= abat_nr
-                        eventos.append({
-                            'data': ev_nr['data'], 'parcela': '', 'tipo': ev_nr['tipo'], 'valor': ev_nr['valor'],
-                            'juros': juros, 'dias_corridos': dias_corr, 'taxa_efetiva': taxa_eff,
-                            'incc': 0.0, 'ipca': ipca_nr, 'taxas_extra': extras_nr,
-                            'Total de mudança (R$)': -abat_nr, 'saldo': saldo
-                        })
-
-                    # >>> ORDEM CORRETA A PARTIR DAQUI <<<
-
-                    # (b) parcela mensal pós — calcula encargos ANTES dos associados
-                    juros, dias_corr, taxa_eff = tracker_pos.calculate(d_evt, saldo)
-                    ipca = saldo * TAXA_IPCA
-                    extras = [saldo * t['pct'] if t['periodo'] in ['pós-entrega da chave', 'ambos'] else 0.0 for t in taxas_extras]
-                    total_taxas = sum(extras) + ipca
-                    valor_total = capacidade_pos
-                    abat_mes = valor_total - juros - total_taxas
-                    saldo -= abat_mes
-                    eventos.append({
-                        'data': d_evt, 'parcela': parcelas, 'tipo': 'Pós-Entrega', 'valor': valor_total,
-                        'juros': juros, 'dias_corridos': dias_corr, 'taxa_efetiva': taxa_eff,
-                        'incc': 0.0, 'ipca': ipca, 'taxas_extra': extras,
-                        'Total de mudança (R$)': -abat_mes, 'saldo': saldo
-                    })
-                    parcelas += 1
-
-                    # (c) associados do dia — linhas separadas, zerando encargos, DEPOIS da parcela
-                    associados = [e for e in post_nr if e['assoc'] and e['data'] == d_evt]
-                    for ev_as in associados:
-                        abat_assoc = ev_as['valor']
-                        saldo -= abat_assoc
-                        eventos.append({
-                            'data': d_evt, 'parcela': '', 'tipo': ev_as['tipo'] + " (Associado)", 'valor': ev_as['valor'],
-                            'juros': 0.0, 'dias_corridos': 0, 'taxa_efetiva': 0.0,
-                            'incc': 0.0, 'ipca': 0.0, 'taxas_extra': [0.0]*len(taxas_extras),
-                            'Total de mudança (R$)': -abat_assoc, 'saldo': saldo
-                        })
-
-                    prev_date = d_evt
-                    cursor = d_evt
-
-
-                # --- Rotulagem k/N baseada nos eventos EFETIVOS (pré+pós, associados e não) ---
-                def _is_semi(t):   return str(t).startswith("Pagamento Semestral")
-                def _is_annual(t): return str(t).startswith("Pagamento Anual")
-
-                eventos_sorted = sorted(eventos, key=lambda x: x['data'])
-
-                semi_idxs   = [i for i,ev in enumerate(eventos_sorted) if _is_semi(ev['tipo'])]
-                annual_idxs = [i for i,ev in enumerate(eventos_sorted) if _is_annual(ev['tipo'])]
-
-                semi_N   = len(semi_idxs)
-                annual_N = len(annual_idxs)
-
-                # zera 'parcela' textual para não conflitar com parcelas mensais (inteiros)
-                for ev in eventos_sorted:
-                    if not isinstance(ev.get('parcela',''), int):
-                        ev['parcela'] = ''
-
-                for k, i in enumerate(semi_idxs, start=1):
-                    eventos_sorted[i]['parcela'] = f"{k}/{semi_N}" if semi_N else ''
-                for k, i in enumerate(annual_idxs, start=1):
-                    eventos_sorted[i]['parcela'] = f"{k}/{annual_N}" if annual_N else ''
+
+                fluxo = simular_fluxo(I, E)
+                saldo = fluxo["saldo"]
+                parcelas = fluxo["parcelas"]
+                eventos_sorted = rotular_parcelas(fluxo["eventos"])
 
                 # ========== Excel ==========
                 wb = Workbook()
                 ws = wb.active
                 ws.title = f"Financ-{cliente}"[:31]
-                headers = ["Data","Parcela","Tipo","Dias no Mês","Dias Corridos","Taxa Efetiva","Valor Pago (R$)",
-                           "Juros (R$)"]
-                headers += [f"Taxa {i+1} (R$)" for i in range(len(taxas_extras))]
-                headers += ["Total de adições e subtrações (R$)","Saldo Devedor (R$)"]
-
-                # Cabeçalho
-                for i, h in enumerate(headers, 1):
-                    cell = ws.cell(row=1, column=i, value=h)
-                    cell.fill = HEADER_FILL
-                    cell.font = Font(bold=True)
-
-                # Linha inicial (saldo)
-                ws.append(["-"]*(len(headers)-1) + [valor_imovel])
-
-                # Eventos ordenados
-                for ev in eventos_sorted:
-                    row = [
-                        ev['data'],
-                        ev.get('parcela', ''),
-                        ev['tipo'],
-                        days_in_month(ev['data']),
-                        ev.get('dias_corridos', ''),
-                        ev.get('taxa_efetiva', ''),
-                        ev.get('valor', 0),
-                        ev.get('juros', 0),
-
-                    ]
-                    row += ev.get('taxas_extra', []) + [ev.get('Total de mudança (R$)', 0), ev.get('saldo', 0)]
-                    ws.append(row)
-
-                # Linha em branco
-                ws.append([''] * len(headers))
-
-                # Totais
-                soma_total = (sum(ev['valor'] for ev in eventos if isinstance(ev['valor'], (int, float))))+ (TAXA_EMISSAO_CCB + TAXA_EMISSAO_CONTRATO_ALIENACAO_FIDUCIARIA + TAXA_REGISTRO_IMOVEL + TAXA_ESCRITURA_IMOVEL + fee)
-                soma_juros = (sum(ev['juros']for ev in eventos if isinstance(ev['valor'], (int, float))))
-                ws.append(['TOTAIS', '', '', '', '', '', soma_total, soma_juros])
-                totals_row = ws.max_row
-                ws.cell(row=totals_row, column=1).fill = HEADER_FILL
-                ws.cell(row=totals_row, column=1).font = Font(bold=True)
-
-                # Negrito em todas as células da linha de totais + borda pontilhada acima
-                for col_idx in range(1, len(headers) + 1):
-                    cell = ws.cell(row=totals_row, column=col_idx)
-                    cell.font = Font(bold=True)
-                    # preserva bordas existentes e adiciona top pontilhada
-                    cell.border = Border(
-                        left=cell.border.left,
-                        right=cell.border.right,
-                        bottom=cell.border.bottom,
-                        top=Side(style="dotted", color="FF000000")
-                    )
-
-                # Ajuste largura
-                for col_cells in ws.columns:
-                    max_length = 0
-                    column = get_column_letter(col_cells[0].column)
-                    for cell in col_cells:
-                        if cell.value is not None:
-                            max_length = max(max_length, len(str(cell.value)))
-                    ws.column_dimensions[column].width = max_length + 2
-
-                # Formatos
-                for col_idx, h in enumerate(headers, start=1):
-                    for row_idx in range(2, ws.max_row + 1):
-                        cell = ws.cell(row=row_idx, column=col_idx)
-                        if h == "Data":
-                            cell.number_format = DATE_FORMAT
-                        elif h in ["Parcela", "Dias no Mês", "Dias Corridos"]:
-                            cell.number_format = '0'
-                        elif h == "Taxa Efetiva":
-                            cell.number_format = PERCENT_FORMAT
-                        else:
-                            cell.number_format = CURRENCY_FORMAT
-
-                # Coloração por sinal na coluna "Total de adições e subtrações (R$)"
-                total_col_idx = headers.index("Total de adições e subtrações (R$)") + 1
-                for row_idx in range(2, ws.max_row + 1):
-                    cell = ws.cell(row=row_idx, column=total_col_idx)
-                    try:
-                        val = float(cell.value)
-                        if val < 0:  # abatimento => verde
-                            cell.font = Font(color=GREEN_COLOR)
-                        elif val > 0:  # adição => vermelho
-                            cell.font = Font(color=RED_COLOR)
-                    except (TypeError, ValueError):
-                        pass
+                montar_aba(ws, I, fluxo, eventos_sorted)
 
                 # Aviso de limite
                 if parcelas >= 420 and saldo > 0:
@@ -745,6 +1334,41 @@ def app_body():
                 st.error("Ocorreu um erro ao gerar a planilha.")
                 st.exception(e)
 
+        st.markdown("### Comparar empreendimentos")
+        nomes_cmp = st.multiselect("Empreendimentos", options=list(taxas_por_emp.keys()),
+                                   default=list(taxas_por_emp.keys()),
+                                   help="Roda os mesmos dados do cliente com as taxas de cada empreendimento.")
+        abas_cmp = st.checkbox("Gerar planilha com uma aba por empreendimento", value=False)
+
+        if st.button("Comparar"):
+            try:
+                if 'inputs' not in st.session_state:
+                    st.error("Preencha a aba 'Dados do contrato' antes.")
+                    st.stop()
+                if not nomes_cmp:
+                    st.error("Selecione ao menos um empreendimento.")
+                    st.stop()
+                I = st.session_state.inputs
+                E = st.session_state.get("extras", {"non_rec": [], "semi_series": [], "annual_series": []})
+                cliente = I["cliente"]
+
+                agenda = preparar_agenda(I, E)
+                linhas = comparar_empreendimentos(I, E, taxas_por_emp, nomes_cmp, agenda=agenda)
+                st.dataframe(linhas, use_container_width=True, hide_index=True)
+
+                if abas_cmp:
+                    wb = planilha_comparacao(I, E, taxas_por_emp, linhas, agenda=agenda)
+                    buf = BytesIO()
+                    wb.save(buf)
+                    buf.seek(0)
+                    st.download_button("Download Excel (comparação)",
+                                       data=buf,
+                                       file_name=f"Comparação {cliente or 'Cliente'}.xlsx",
+                                       mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+            except Exception as e:
+                st.error("Ocorreu um erro ao comparar os empreendimentos.")
+                st.exception(e)
+
 # ==========================
 # Main
 # ==========================
@@ -0,0 +1,292 @@
+# referencia.py
+"""Cópia congelada do cálculo do fluxo do `app_body` original, antes dos motores otimizados.
+
+Não editar: é a referência independente usada por `benchmark.py`. O corpo de
+`fluxo_referencia` é o trecho do botão "Gerar Planilha" (da expansão dos extras até o rótulo
+k/N, mais as somas da linha TOTAIS), copiado sem mudanças; `adjust_day` e `PaymentTracker`
+também são cópias, para não compartilhar código com `fluxo.py`. Só aceita taxas escalares.
+"""
+import calendar
+
+from dateutil.relativedelta import relativedelta
+
+
+def adjust_day(date, preferred_day):
+    try:
+        return date.replace(day=preferred_day)
+    except ValueError:
+        last = calendar.monthrange(date.year, date.month)[1]
+        return date.replace(day=last)
+
+class PaymentTracker:
+    def __init__(self, dia_pagamento, taxa_juros):
+        self.last_date = None
+        self.dia = dia_pagamento
+        self.taxa = taxa_juros
+    def calculate(self, current_date, saldo):
+        if self.last_date is None:
+            self.last_date = current_date
+            return 0.0, 0, 0.0
+        dias_corridos = (current_date - self.last_date).days
+        taxa_efetiva = self.taxa * (dias_corridos / 30)
+        juros = saldo * taxa_efetiva
+        self.last_date = current_date
+        return juros, dias_corridos, taxa_efetiva
+
+
+def fluxo_referencia(I, E):
+    """Executa o algoritmo original e devolve eventos (ordem de geração e ordenados/rotulados),
+    saldo, parcelas, fee e os totais da planilha."""
+    dia_pagamento = I["dia_pagamento"]
+    valor_imovel = I["valor_imovel"]
+    TAXA_EMISSAO_CCB = I["TAXA_EMISSAO_CCB"]
+    TAXA_EMISSAO_CONTRATO_ALIENACAO_FIDUCIARIA = I["TAXA_EMISSAO_CONTRATO_ALIENACAO_FIDUCIARIA"]
+    TAXA_REGISTRO_IMOVEL = I["TAXA_REGISTRO_IMOVEL"]
+    TAXA_ESCRITURA_IMOVEL = I["TAXA_ESCRITURA_IMOVEL"]
+    TAXA_SEGURO_PRESTAMISTA_PCT = I["TAXA_SEGURO_PRESTAMISTA_PCT"]
+    TAXA_INCC = I["TAXA_INCC"]
+    TAXA_IPCA = I["TAXA_IPCA"]
+    taxa_pre = I["taxa_pre"]
+    taxa_pos = I["taxa_pos"]
+    taxas_extras = I["taxas_extras"]
+    data_base = I["data_base"]
+    data_inicio_pre = I["data_inicio_pre"]
+    data_entrega = I["data_entrega"]
+    capacidade_pre = I["capacidade_pre"]
+    capacidade_pos_antes = I["capacidade_pos_antes"]
+    val_parcela_banco = I["val_parcela_banco"]
+    capacidade_pos = I["capacidade_pos"]
+    fgts = I["fgts"]
+    fin_banco = I["fin_banco"]
+
+    # Copia listas de extras
+    non_rec = list(E["non_rec"])
+    semi_series = list(E["semi_series"])
+    annual_series = list(E["annual_series"])
+
+    # Agrega séries recorrentes (gera agenda bruta)
+    for series in semi_series:
+        for n in range(100):
+            d = series['d0'] + relativedelta(months=6 * n)
+            if series['assoc']:
+                d = adjust_day(d, dia_pagamento)
+            non_rec.append({'data': d, 'tipo': 'Pagamento Semestral', 'valor': series['v'], 'assoc': series['assoc']})
+    for series in annual_series:
+        for n in range(100):
+            d = series['d0'] + relativedelta(years=n)
+            if series['assoc']:
+                d = adjust_day(d, dia_pagamento)
+            non_rec.append({'data': d, 'tipo': 'Pagamento Anual', 'valor': series['v'], 'assoc': series['assoc']})
+
+    # Separa pré/pós
+    pre_nr = sorted([e for e in non_rec if e['data'] < data_entrega], key=lambda x: x['data'])
+    post_nr = sorted([e for e in non_rec if e['data'] >= data_entrega], key=lambda x: x['data'])
+
+    # Coletores
+    eventos = []
+    saldo = valor_imovel
+
+    # Contagem de parcelas especiais (para exibir k/N)
+    semi_total = len([e for e in non_rec if e['tipo'] == 'Pagamento Semestral'])
+    annual_total = len([e for e in non_rec if e['tipo'] == 'Pagamento Anual'])
+    semi_seq = 0
+    annual_seq = 0
+
+    # Data base
+    eventos.append({
+        'data': data_base, 'parcela': '', 'tipo': 'Data-Base (assinatura do contrato)',
+        'valor': 0.0, 'juros': 0.0, 'dias_corridos': 0, 'taxa_efetiva': 0.0,
+        'incc': 0.0, 'ipca': 0.0, 'taxas_extra': [0.0] * len(taxas_extras),
+        'Total de mudança (R$)': 0.0, 'saldo': saldo
+    })
+
+    # ========== PRÉ-ENTREGA ==========
+    tracker_pre = PaymentTracker(dia_pagamento, taxa_pre)
+    tracker_pre.last_date = data_base
+
+    prev_date = data_inicio_pre
+    cursor = data_inicio_pre
+    while True:
+        d_evt = adjust_day(cursor, dia_pagamento)
+        if d_evt >= data_entrega:
+            break
+
+        # (a) não-associados entre prev_date e d_evt — seguem iguais
+        for ev_nr in [e for e in pre_nr if not e['assoc'] and prev_date < e['data'] < d_evt]:
+            juros, dias_corr, taxa_eff = tracker_pre.calculate(ev_nr['data'], saldo)
+            incc_nr = saldo * TAXA_INCC
+            extras_nr = [saldo * t['pct'] if t['periodo'] in ['pré-entrega da chave', 'ambos'] else 0.0 for t in taxas_extras]
+            total_taxas_nr = sum(extras_nr) + incc_nr
+            abat_nr = ev_nr['valor'] - juros - total_taxas_nr
+            saldo -= abat_nr
+            eventos.append({
+                'data': ev_nr['data'], 'parcela': '', 'tipo': ev_nr['tipo'], 'valor': ev_nr['valor'],
+                'juros': juros, 'dias_corridos': dias_corr, 'taxa_efetiva': taxa_eff,
+                'incc': incc_nr, 'ipca': 0.0, 'taxas_extra': extras_nr,
+                'Total de mudança (R$)': -abat_nr, 'saldo': saldo
+            })
+
+        # >>> ORDEM CORRETA A PARTIR DAQUI <<<
+
+        # (b) parcela mensal pré — calcula encargos ANTES dos associados
+        juros, dias_corr, taxa_eff = tracker_pre.calculate(d_evt, saldo)
+        incc = saldo * TAXA_INCC
+        extras = [saldo * t['pct'] if t['periodo'] in ['pré-entrega da chave', 'ambos'] else 0.0 for t in taxas_extras]
+        total_taxas = sum(extras) + incc
+        valor_total = capacidade_pre
+        abat_mes = valor_total - juros - total_taxas
+        saldo -= abat_mes
+        eventos.append({
+            'data': d_evt, 'parcela': '', 'tipo': 'Pré-Entrega', 'valor': valor_total,
+            'juros': juros, 'dias_corridos': dias_corr, 'taxa_efetiva': taxa_eff,
+            'incc': incc, 'ipca': 0.0, 'taxas_extra': extras,
+            'Total de mudança (R$)': -abat_mes, 'saldo': saldo
+        })
+
+        # (c) associados do dia — linhas separadas, zerando encargos, DEPOIS da parcela
+        associados = [e for e in pre_nr if e['assoc'] and e['data'] == d_evt]
+        for ev_as in associados:
+            abat_assoc = ev_as['valor']  # 100% para principal
+            saldo -= abat_assoc
+            eventos.append({
+                'data': d_evt, 'parcela': '', 'tipo': ev_as['tipo'] + " (Associado)", 'valor': ev_as['valor'],
+                'juros': 0.0, 'dias_corridos': 0, 'taxa_efetiva': 0.0,
+                'incc': 0.0, 'ipca': 0.0, 'taxas_extra': [0.0]*len(taxas_extras),
+                'Total de mudança (R$)': -abat_assoc, 'saldo': saldo
+            })
+
+        prev_date = d_evt
+        cursor += relativedelta(months=1)
+
+
+    # ========== ENTREGA ==========
+    ent = data_entrega
+    zero_extras = [0.0] * len(taxas_extras)
+
+    for desc, v in [('Abatimento FGTS', fgts), ('Abatimento Fin. Banco', fin_banco)]:
+        saldo -= v
+        eventos.append({
+            'data': ent, 'parcela': '', 'tipo': desc, 'valor': 0.0,
+            'juros': 0.0, 'dias_corridos': '', 'taxa_efetiva': '',
+            'incc': 0.0, 'ipca': 0.0, 'taxas_extra': zero_extras,
+            'Total de mudança (R$)': -v,  # abatimento => negativo
+            'saldo': saldo
+        })
+
+    for nome, val in [('Emissão CCB', TAXA_EMISSAO_CCB),
+                      ('Alienação Fiduciária', TAXA_EMISSAO_CONTRATO_ALIENACAO_FIDUCIARIA),
+                      ('Registro', TAXA_REGISTRO_IMOVEL),
+                      ('Escritura Imóvel', TAXA_ESCRITURA_IMOVEL)]:
+        saldo += val
+        eventos.append({
+            'data': ent, 'parcela': '', 'tipo': 'Taxa ' + nome, 'valor': 0.0,
+            'juros': 0.0, 'dias_corridos': '', 'taxa_efetiva': '',
+            'incc': 0.0, 'ipca': 0.0, 'taxas_extra': zero_extras,
+            'Total de mudança (R$)': val,  # adiciona saldo => positivo
+            'saldo': saldo
+        })
+
+    fee = saldo * TAXA_SEGURO_PRESTAMISTA_PCT
+    saldo += fee
+    eventos.append({
+        'data': ent, 'parcela': '', 'tipo': 'Taxa Seguro Prestamista', 'valor': 0.0,
+        'juros': 0.0, 'dias_corridos': '', 'taxa_efetiva': '',
+        'incc': 0.0, 'ipca': 0.0, 'taxas_extra': zero_extras,
+        'Total de mudança (R$)': fee,  # adiciona saldo => positivo
+        'saldo': saldo
+    })
+
+    eventos.append({
+        'data': ent, 'parcela': '', 'tipo': 'Data da entrega das chaves', 'valor': 0.0,
+        'juros': 0.0, 'dias_corridos': 0, 'taxa_efetiva': 0.0,
+        'incc': 0.0, 'ipca': 0.0, 'taxas_extra': [0.0]*len(taxas_extras),
+        'Total de mudança (R$)': 0.0, 'saldo': saldo
+    })
+
+    # ========== PÓS-ENTREGA ==========
+    tracker_pos = PaymentTracker(dia_pagamento, taxa_pos)
+    tracker_pos.last_date = data_entrega
+    prev_date = data_entrega
+    cursor = data_entrega
+    parcelas = 1
+
+    while saldo > 0 and parcelas <= 420:
+        d_evt = adjust_day(cursor + relativedelta(months=1), dia_pagamento)
+
+        # (a) não-associados entre prev_date e d_evt — seguem iguais
+        for ev_nr in [e for e in post_nr if not e['assoc'] and prev_date < e['data'] < d_evt]:
+            juros, dias_corr, taxa_eff = tracker_pos.calculate(ev_nr['data'], saldo)
+            ipca_nr = saldo * TAXA_IPCA
+            extras_nr = [saldo * t['pct'] if t['periodo'] in ['pós-entrega da chave', 'ambos'] else 0.0 for t in taxas_extras]
+            total_taxas_nr = sum(extras_nr) + ipca_nr
+            abat_nr = ev_nr['valor'] - juros - total_taxas_nr
+            saldo -= abat_nr
+            eventos.append({
+                'data': ev_nr['data'], 'parcela': '', 'tipo': ev_nr['tipo'], 'valor': ev_nr['valor'],
+                'juros': juros, 'dias_corridos': dias_corr, 'taxa_efetiva': taxa_eff,
+                'incc': 0.0, 'ipca': ipca_nr, 'taxas_extra': extras_nr,
+                'Total de mudança (R$)': -abat_nr, 'saldo': saldo
+            })
+
+        # >>> ORDEM CORRETA A PARTIR DAQUI <<<
+
+        # (b) parcela mensal pós — calcula encargos ANTES dos associados
+        juros, dias_corr, taxa_eff = tracker_pos.calculate(d_evt, saldo)
+        ipca = saldo * TAXA_IPCA
+        extras = [saldo * t['pct'] if t['periodo'] in ['pós-entrega da chave', 'ambos'] else 0.0 for t in taxas_extras]
+        total_taxas = sum(extras) + ipca
+        valor_total = capacidade_pos
+        abat_mes = valor_total - juros - total_taxas
+        saldo -= abat_mes
+        eventos.append({
+            'data': d_evt, 'parcela': parcelas, 'tipo': 'Pós-Entrega', 'valor': valor_total,
+            'juros': juros, 'dias_corridos': dias_corr, 'taxa_efetiva': taxa_eff,
+            'incc': 0.0, 'ipca': ipca, 'taxas_extra': extras,
+            'Total de mudança (R$)': -abat_mes, 'saldo': saldo
+        })
+        parcelas += 1
+
+        # (c) associados do dia — linhas separadas, zerando encargos, DEPOIS da parcela
+        associados = [e for e in post_nr if e['assoc'] and e['data'] == d_evt]
+        for ev_as in associados:
+            abat_assoc = ev_as['valor']
+            saldo -= abat_assoc
+            eventos.append({
+                'data': d_evt, 'parcela': '', 'tipo': ev_as['tipo'] + " (Associado)", 'valor': ev_as['valor'],
+                'juros': 0.0, 'dias_corridos': 0, 'taxa_efetiva': 0.0,
+                'incc': 0.0, 'ipca': 0.0, 'taxas_extra': [0.0]*len(taxas_extras),
+                'Total de mudança (R$)': -abat_assoc, 'saldo': saldo
+            })
+
+        prev_date = d_evt
+        cursor = d_evt
+
+
+    # --- Rotulagem k/N baseada nos eventos EFETIVOS (pré+pós, associados e não) ---
+    def _is_semi(t):   return str(t).startswith("Pagamento Semestral")
+    def _is_annual(t): return str(t).startswith("Pagamento Anual")
+
+    eventos_sorted = sorted(eventos, key=lambda x: x['data'])
+
+    semi_idxs   = [i for i,ev in enumerate(eventos_sorted) if _is_semi(ev['tipo'])]
+    annual_idxs = [i for i,ev in enumerate(eventos_sorted) if _is_annual(ev['tipo'])]
+
+    semi_N   = len(semi_idxs)
+    annual_N = len(annual_idxs)
+
+    # zera 'parcela' textual para não conflitar com parcelas mensais (inteiros)
+    for ev in eventos_sorted:
+        if not isinstance(ev.get('parcela',''), int):
+            ev['parcela'] = ''
+
+    for k, i in enumerate(semi_idxs, start=1):
+        eventos_sorted[i]['parcela'] = f"{k}/{semi_N}" if semi_N else ''
+    for k, i in enumerate(annual_idxs, start=1):
+        eventos_sorted[i]['parcela'] = f"{k}/{annual_N}" if annual_N else ''
+
+    # Totais (mesmas somas da linha TOTAIS da planilha)
+    soma_total = (sum(ev['valor'] for ev in eventos if isinstance(ev['valor'], (int, float))))+ (TAXA_EMISSAO_CCB + TAXA_EMISSAO_CONTRATO_ALIENACAO_FIDUCIARIA + TAXA_REGISTRO_IMOVEL + TAXA_ESCRITURA_IMOVEL + fee)
+    soma_juros = (sum(ev['juros']for ev in eventos if isinstance(ev['valor'], (int, float))))
+
+    return {'eventos': eventos, 'eventos_sorted': eventos_sorted, 'saldo': saldo, 'parcelas': parcelas,
+            'fee': fee, 'soma_total': soma_total, 'soma_juros': soma_juros}